@@ -1,62 +1,148 @@
 import re
 import json
+from CMR_Queries.regex_utility import ASCII_LETTERS, REGEX_SPECIAL_CHARACTERS
 
 """
     This gets called from sentence_label utilities to identify spatial resolutions and authors
 """
 
 
+class AuthorIndex:
+    # names: author last names (keywords['author_last_names']) or full names (keywords['author_names']). A name with more
+    # than one token (ie: 'cady-periera' or 'eric fetzer') is looked up by its first token and then checked in place
+    def __init__(self, names):
+        self.names = list(names)
+        self.positions = {}  # name -> where it is in the list, so the matches come back in the same order as the names
+        for position, name in enumerate(self.names):
+            self.positions.setdefault(name, []).append(position)
+        self.letters = re.compile(r'[a-zA-Z]+')
+        self.first_token_to_names = {}
+        self.regex_names = {}  # names that can't be matched as plain text keep their own compiled pattern
+        for name in self.names:
+            if name == '' or REGEX_SPECIAL_CHARACTERS.intersection(name) or name[0] not in ASCII_LETTERS or name[-1] not in ASCII_LETTERS:
+                self.regex_names[name] = re.compile(rf'[^a-zA-Z]({name})[^a-zA-Z]')
+                continue
+            first_token = self.letters.match(name).group()
+            self.first_token_to_names.setdefault(first_token, [])
+            if name not in self.first_token_to_names[first_token]:
+                self.first_token_to_names[first_token].append(name)
+        self.first_tokens = frozenset(self.first_token_to_names)
+
+    # Same matches as re.findall(rf'[^a-zA-Z]({name})[^a-zA-Z]', lowercase_sentence) for every name in order. The
+    # characters on both sides are part of each match, so two matches of the same name need two characters between them
+    def find(self, lowercase_sentence):
+        counts = {}
+        if not self.first_tokens.isdisjoint(self.letters.findall(lowercase_sentence)):  # the sentence is tokenized once
+            next_free = {}
+            for token in self.letters.finditer(lowercase_sentence):
+                start = token.start()
+                for name in self.first_token_to_names.get(token.group(), ()):
+                    end = start + len(name)
+                    if start == 0 or start - 1 < next_free.get(name, 0) or end >= len(lowercase_sentence):
+                        continue
+                    if lowercase_sentence[end] in ASCII_LETTERS or not lowercase_sentence.startswith(name, start):
+                        continue
+                    counts[name] = counts.get(name, 0) + 1
+                    next_free[name] = end + 1
+
+        found = [(position, [name] * count) for name, count in counts.items() for position in self.positions[name]]
+        for name, pattern in self.regex_names.items():
+            matches = pattern.findall(lowercase_sentence)
+            if matches:
+                found += [(position, matches) for position in self.positions[name]]
+
+        authors = []
+        for _, matches in sorted(found):
+            authors += matches
+        return authors
+
+
 # Search for an author name in the sentence passed in. May find extra authors if author has a last time that is sometimes
-# used just like a common word
-def label_author(lowercase_sentence, keywords):
-    authors_list = keywords['author_last_names']
-    authors = []
+# used just like a common word. Build the AuthorIndex once and pass it in when labelling many sentences
+def label_author(lowercase_sentence, keywords, author_index=None):
+    if author_index is None:
+        author_index = AuthorIndex(keywords['author_last_names'])
+    return author_index.find(lowercase_sentence)
+
+
+# regex patterns crafted to identify spatial resolutions. Note that the order matters. more specific -> less specific
+RESOLUTION_PATTERNS = [r'\d+(?:\.\d+)? ?(?:to|\-) ?\d+ k?m(?!hz)',  # 2 - 4 km,
+                       r'\d+(?:\.\d+)? ?(?:k?m)? ?[\u00d7|x] ?\d+(?:\.\d+)? ?k?m',  #40km x 320km
+                       r'\d+(?:\.\d+)?[ \-]k?m(?!hz)',  # 2.3km. For both not mhz
+                       r'\d+(?:\.\d+)?\u25e6? ?[\u00d7|x] ?\d+(?:\.\d+)?\u25e6',  # 5.6◦ × 5.6◦
+                       r'\d+(?:\.\d+)?◦']  # 5.6◦
+
+
+class ResolutionExtractor:
+    # Everything is compiled once. The resolution patterns are joined into one alternation (in the same order, so at any
+    # position the more specific pattern still wins) and the sentence is scanned a single time
+    def __init__(self):
+        self.key_phrases = re.compile(r'(?:vertical|horizontal) resolution')
+        self.years = re.compile(r'\d{4}(?! ?k?m)')  # 4-digit (year) numbers unless is a distance in km or m
+        self.digit = re.compile(r'\d')
+        self.space_digit = re.compile(r' \d')
+        self.not_resolution_numbers = re.compile(r'(fig )|(table )|(version )|(level )\d')
+        # every pattern starts with a digit, the lookahead lets the scan skip the other positions quickly
+        self.resolutions = re.compile(r'(?=\d)(?:' + '|'.join(f'({pattern})' for pattern in RESOLUTION_PATTERNS) + ')')
+        self.values = re.compile(r'(\d+(?:\.\d+)?)[ \-]?(km|m|\u25e6)?')
+
+    # Determine if the candidate lowercase sentence actually contains spatial resolutions. Returns the matches grouped by
+    # pattern, in the pattern order
+    def get_resolution(self, lowercase_sentence):
+        by_pattern = [[] for _ in RESOLUTION_PATTERNS]
+        for match in self.resolutions.finditer(lowercase_sentence):
+            by_pattern[match.lastindex - 1].append(match.group())
+        return [resolution for matches in by_pattern for resolution in matches]
+
+    # The numbers in a resolution converted to km (or degrees for the ◦ patterns). A number without a unit takes the unit
+    # that comes after it (ie: '2 - 4 km' -> [2.0, 4.0] km)
+    def normalize(self, resolution):
+        numbers = self.values.findall(resolution)
+        values, unit = [], None
+        for number, number_unit in reversed(numbers):
+            unit = number_unit or unit
+            values.append(float(number) / 1000 if unit == 'm' else float(number))
+        return {"values": values[::-1], "unit": 'degrees' if unit == '\u25e6' else 'km'}
+
+    # Find candidate phrases that may contain spatial resolutions and pull the resolutions out of them.
+    # Returns the resolution strings and their normalized values (same order)
+    def extract(self, lowercase_sentence):
+        # quick check before doing any regex work. A year removed from the middle of 'resolution' still leaves 'resol' or 'lution'
+        if 'resol' not in lowercase_sentence and 'lution' not in lowercase_sentence:
+            return [], []
 
-    for last_name in authors_list:
-        author_matches = re.findall(rf'[^a-zA-Z]({last_name})[^a-zA-Z]', lowercase_sentence)
-        if len(author_matches) > 0:
-            authors += author_matches
+        # remove years as this sometimes creates noise
+        lowercase_sentence = self.years.sub('', lowercase_sentence)
 
-    return authors
+        key_phrases_found = len(set(self.key_phrases.findall(lowercase_sentence)))
+        if key_phrases_found == 0:
+            return [], []
+
+        # has some digits that are denoting things other figures, tables, versions, or level
+        if not self.digit.search(lowercase_sentence) or len(self.space_digit.findall(lowercase_sentence)) <= len(self.not_resolution_numbers.findall(lowercase_sentence)):
+            return [], []
+
+        # the resolutions are added once for each key phrase in the sentence
+        resolutions = self.get_resolution(lowercase_sentence) * key_phrases_found
+        return resolutions, [self.normalize(resolution) for resolution in resolutions]
+
+
+_default_extractor = ResolutionExtractor()
+
+
+def get_default_resolution_extractor():
+    return _default_extractor
 
 
 # Determine if the candidate lowercase sentence actually contains spatial resolutions
 def get_resolution(lowercase_sentence):
-    # regex patterns crafted to identify spatial resolutions. Note that the order matters. more specific -> less specific
-    patterns = [r'(\d+(?:\.\d+)? ?(?:to|\-) ?\d+ k?m(?!hz))', # 2 - 4 km,
-                r'\d+(?:\.\d+)? ?(?:k?m)? ?[\u00d7|x] ?\d+(?:\.\d+)? ?k?m',  #40km x 320km
-                r'(\d+(?:\.\d+)?[ \-]k?m(?!hz))',  # 2.3km. For both not mhz
-                r'\d+(?:\.\d+)?\u25e6? ?[\u00d7|x] ?\d+(?:\.\d+)?\u25e6',  # 5.6◦ × 5.6◦
-                r'\d+(?:\.\d+)?◦']  # 5.6◦
-
-    resolutions = []
-    for pattern in patterns:
-        if len(re.findall(pattern, lowercase_sentence)) > 0:
-            res = re.findall(pattern, lowercase_sentence)
-            # print(res)
-            resolutions += res
-            lowercase_sentence = re.sub(pattern, '', lowercase_sentence)
-    return resolutions
+    return _default_extractor.get_resolution(lowercase_sentence)
 
 
 # Find candidate phrases that may contain spatial resolutions. Pass them into get_resolution to determine if actually a
 # spatial resolution of not
 def identify_spatial_resolution(lowercase_sentence):
-    key_phrases = ['vertical resolution', 'horizontal resolution']
-    with_numbers, without_numbers, found_resolutions = [], [], []
-    # remove years as this sometimes creates noise
-    lowercase_sentence = re.sub(r'\d{4}(?! ?k?m)', '', lowercase_sentence)  # remove 4-digit (year) numbers unless is a distance in km or m
-
-    for kp in key_phrases:  # candidate phrases that may contain spatial resolutions
-        if len(re.findall(rf'{kp}', lowercase_sentence)) > 0:
-            # has some digits that are denoting things other figures, tables, versions, or level
-            if len(re.findall(r'\d', lowercase_sentence)) > 0 and len(re.findall(r' \d', lowercase_sentence)) > len(re.findall(r'(fig )|(table )|(version )|(level )\d', lowercase_sentence)):
-                with_numbers.append(lowercase_sentence)  # just for debugging
-                found_resolutions += get_resolution(lowercase_sentence)  # determine if the sentence actually has a spatial resolution mentioned
-            else:
-                without_numbers.append(lowercase_sentence)  # just for debugging
-
-    return found_resolutions
+    return _default_extractor.extract(lowercase_sentence)[0]
 
 # just experiments to text some of the functions.
 if __name__ == '__main__':
@@ -71,4 +157,34 @@ if __name__ == '__main__':
     print(results)
 
     spatial = identify_spatial_resolution(s.lower())
-    print(spatial)
\ No newline at end of file
+    print(spatial)
+
+    # micro-benchmark: one findall per author name (how label_author used to work) vs the author index
+    import time
+
+    def label_author_findall(lowercase_sentence, names):
+        authors = []
+        for last_name in names:
+            author_matches = re.findall(rf'[^a-zA-Z]({last_name})[^a-zA-Z]', lowercase_sentence)
+            if len(author_matches) > 0:
+                authors += author_matches
+        return authors
+
+    sentences = ['the results were observed by (livesey et al) and froidevaux et al in 2012',
+                 'the aura mls version 4 level 2 ozone profiles have a vertical resolution of 3 km',
+                 'we thank eric fetzer, luis millan and cady-periera for the airs data (fetzer fetzer, 2003)',
+                 'the tropospheric no2 columns were retrieved from omi level 2 data products'] * 250
+    for names_key in ['author_last_names', 'author_names']:
+        index = AuthorIndex(keywords[names_key])
+        assert all(label_author_findall(s, keywords[names_key]) == index.find(s) for s in sentences)
+
+        start = time.perf_counter()
+        for s in sentences:
+            label_author_findall(s, keywords[names_key])
+        before = (time.perf_counter() - start) / len(sentences) * 1e6
+
+        start = time.perf_counter()
+        for s in sentences:
+            index.find(s)
+        after = (time.perf_counter() - start) / len(sentences) * 1e6
+        print(f'{names_key} ({len(keywords[names_key])} names): {before:.1f}us -> {after:.1f}us per sentence')
@@ -44,18 +44,23 @@ if __name__ == '__main__':
     mission_instrument_couples = '../data/json/mission_instrument_couples_LOWER.json'
     output_title = 'forward_gesdisc_'
     sort_by_usage = False  # sort CMR Queries by usage
+    workers = 1  # number of processes to split the papers across
 
     # determine manually reviewed datasets for the papers that were reviewed based on zotero notes file
     key_title_ground_truth = get_manually_reviewed_ground_truths(dataset_couples_location, pubs_with_attchs_location, zot_notes_location)
 
-    # Generate Features and CMR results
-    # if you don't want to actually run cmr queries (ie: you just want feature), you can set update_cmr=False
-    sentences_stats_queries = run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_directory, sort_by_usage=sort_by_usage)
-
     # add the date to the file name, so we don't accidentally overwrite stuff
     now = datetime.now()
     current_time = now.strftime("%H-%M-%S") + output_title
 
+    # Generate Features and CMR results
+    # if you don't want to actually run cmr queries (ie: you just want feature), you can set update_cmr=False
+    # the term index is saved next to the features so keyword changes can be re-labelled with relabel_keyword_changes.py
+    # every finished paper is checkpointed. After a crash, pass that checkpoint_location with resume=True to carry on
+    sentences_stats_queries = run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_directory, sort_by_usage=sort_by_usage, workers=workers,
+                                                    term_index_location=current_time + 'features_term_index.json',
+                                                    checkpoint_location=current_time + 'partial_results.jsonl')
+
     with open(current_time + 'key_title_ground_truth.json', 'w', encoding='utf-8') as f:
         json.dump(key_title_ground_truth, f, indent=4)
 
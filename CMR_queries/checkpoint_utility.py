@@ -0,0 +1,91 @@
+"""
+    Append-only checkpoints for long labelling runs (called from run_keyword_sentences in sentence_label_utilities.py, and
+    used as the results file of stream_keyword_sentences in streaming_label_utility.py).
+    The checkpoint is a JSONL file with one line per finished paper: {"pdf_key": ..., "results": {...}}, so saving a
+    paper costs the same no matter how many papers came before it, and a crashed run can be resumed from the file
+"""
+
+import json
+import os
+
+
+# Read the papers that are already finished. A line cut off by a crash is dropped, and removed from the file so the next
+# paper can be appended cleanly
+def load_checkpoint(checkpoint_location):
+    paper_to_results = {}
+    if not os.path.exists(checkpoint_location):
+        return paper_to_results
+
+    with open(checkpoint_location, encoding='utf-8') as f:
+        lines = f.readlines()
+
+    good_lines = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if not line.endswith('\n'):
+            continue
+        paper_to_results[record['pdf_key']] = record['results']
+        good_lines.append(line)
+
+    if len(good_lines) != len(lines):
+        print(f'Dropping {len(lines) - len(good_lines)} incomplete line(s) from {checkpoint_location}')
+        with open(checkpoint_location, 'w', encoding='utf-8') as f:
+            f.writelines(good_lines)
+
+    return paper_to_results
+
+
+# resume=False starts a new checkpoint, resume=True appends to the existing one. A checkpoint that already has papers in
+# it is only started over with overwrite=True, so forgetting resume=True after a crash doesn't throw the papers away
+def open_checkpoint(checkpoint_location, resume=False, overwrite=False):
+    if not resume and not overwrite and os.path.exists(checkpoint_location) and os.path.getsize(checkpoint_location) > 0:
+        raise FileExistsError(f'{checkpoint_location} already has papers in it. Pass resume=True to carry on from it, '
+                              f'or overwrite=True to start over')
+    return open(checkpoint_location, 'a' if resume else 'w', encoding='utf-8')
+
+
+def append_checkpoint(checkpoint_file, paper, results):
+    checkpoint_file.write(json.dumps({"pdf_key": paper, "results": results}) + '\n')
+    checkpoint_file.flush()
+
+
+# Read the finished papers one at a time as (pdf_key, results), without loading the whole file. Lines cut off by a crash
+# are skipped
+def iter_checkpoint(checkpoint_location):
+    if not os.path.exists(checkpoint_location):
+        return
+
+    with open(checkpoint_location, encoding='utf-8') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield record['pdf_key'], record['results']
+
+
+# Cut a line left unfinished by a crash off the end of the checkpoint, so the next paper can be appended cleanly. Unlike
+# load_checkpoint, the file isn't read into memory
+def drop_incomplete_line(checkpoint_location):
+    if not os.path.exists(checkpoint_location):
+        return
+
+    with open(checkpoint_location, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end  # just after the last new line
+        while position > 0:
+            block_start = max(position - 4096, 0)
+            f.seek(block_start)
+            newline = f.read(position - block_start).rfind(b'\n')
+            if newline != -1:
+                position = block_start + newline + 1
+                break
+            position = block_start
+        if position != end:
+            print(f'Dropping an incomplete line from {checkpoint_location}')
+            f.truncate(position)
@@ -0,0 +1,145 @@
+"""
+    Asynchronous version of get_top_cmr_dataset (cmr_query_utilities.py). A single pooled aiohttp session keeps up to
+    max_in_flight CMR requests going at once, and requests that CMR rejects with a 429 (rate limiting) or 5xx are retried
+    with exponential backoff instead of stopping the whole run.
+
+    get_top_cmr_datasets is a synchronous wrapper so code that isn't async can run a batch of queries concurrently
+"""
+
+import asyncio
+import random
+import time
+import aiohttp
+from CMR_Queries import cmr_query_utilities
+from CMR_Queries.cmr_query_utilities import build_cmr_query, parse_cmr_short_names
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class AsyncCMRClient:
+    # max_in_flight: number of requests allowed to be waiting on CMR at the same time
+    # max_retries: how many times to retry a 429/5xx/connection error before giving up
+    # backoff: delay before the first retry. Doubles for every retry after that, up to max_backoff
+    # cache: optional CMRCache (cmr_cache_utility.py)
+    # resolver: optional ScienceKeywordResolver (cmr_query_utilities.py)
+    def __init__(self, max_in_flight=8, max_retries=5, backoff=0.5, max_backoff=30, timeout=60, cache=None, resolver=None):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.cache = cache
+        self.resolver = resolver
+        self.request_count, self.retry_count = 0, 0
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    # exponential backoff with some jitter, unless CMR told us how long to wait
+    def _retry_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # Return the body of the response for the url, from the cache if possible
+    async def query_cmr(self, url):
+        if self.cache:
+            body = self.cache.get(url)
+            if body is not None:
+                return body
+            if self.cache.offline:
+                print(url)
+                raise RuntimeWarning("CMR query is not in the cache and the cache is offline")
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._semaphore:  # the slot is given back while backing off so other queries can go
+                self.request_count += 1
+                try:
+                    async with self._session.get(url) as response:
+                        status = response.status
+                        if status == 200:
+                            body = await response.text()
+                            if self.cache:
+                                self.cache.set(url, body)
+                            return body
+                        retry_after = response.headers.get('Retry-After')
+                        retryable = status in RETRY_STATUS_CODES
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status, retryable = repr(e), True
+
+            if not retryable:
+                break
+            if attempt < self.max_retries:
+                self.retry_count += 1
+                await asyncio.sleep(self._retry_delay(attempt, retry_after))
+
+        print(url)
+        print("response code", status)
+        raise RuntimeWarning("Could not access CMR API")
+
+    # Same parameters and return values as cmr_query_utilities.get_top_cmr_dataset
+    async def get_top_cmr_dataset(self, platform, instrument, science_keyword, science_keyword_search=True, num_results=1, level=None, author=None, resolutions=None, sort_by_usage=False,
+                                  exact_science_keywords=False):
+        url, query_description = build_cmr_query(platform, instrument, science_keyword, science_keyword_search,
+                                                 num_results, level, author, resolutions, sort_by_usage, self.resolver,
+                                                 exact_science_keywords)
+        return query_description, parse_cmr_short_names(await self.query_cmr(url)), url
+
+
+# Run a batch of queries concurrently. Each query is a dict of the keyword arguments for get_top_cmr_dataset. The results
+# are returned in the same order as the queries
+def get_top_cmr_datasets(queries, max_in_flight=8, **client_options):
+    async def run_queries():
+        async with AsyncCMRClient(max_in_flight, **client_options) as client:
+            return await asyncio.gather(*[client.get_top_cmr_dataset(**query) for query in queries])
+
+    return asyncio.run(run_queries())
+
+
+# Benchmark the blocking requests version against the async client on a local mock CMR
+if __name__ == '__main__':
+    from CMR_Queries.mock_cmr_server import start_mock_cmr_server
+
+    latency = 0.05
+    mock_server, mock_url = start_mock_cmr_server(latency=latency)
+    errors_server, errors_url = start_mock_cmr_server(latency=latency, error_rate=0.05)
+
+    species = ['o3', 'h2o', 'hno3', 'n2o', 'co', 'hcl', 'clo', 'so2', 'no2', 'bro']
+    benchmark_queries = [{"platform": platform, "instrument": instrument, "science_keyword": s, "num_results": 20,
+                          "science_keyword_search": search}
+                         for platform, instrument in [('aura', 'mls'), ('aura', 'omi'), (None, 'airs')]
+                         for s in species for search in [True, False]]
+
+    # the blocking version stops at the first error, so it can only be benchmarked on the mock without errors
+    cmr_query_utilities.CMR_COLLECTIONS_URL = mock_url
+    start = time.time()
+    blocking_results = [cmr_query_utilities.get_top_cmr_dataset(**q)[:2] for q in benchmark_queries]
+    blocking_time = time.time() - start
+    print(f'requests.get, one at a time: {len(benchmark_queries)} queries in {blocking_time:.2f}s')
+
+    for in_flight in [1, 8, 32]:
+        start = time.time()
+        async_results = get_top_cmr_datasets(benchmark_queries, max_in_flight=in_flight, backoff=0.01)
+        async_time = time.time() - start
+        print(f'async, max_in_flight={in_flight}: {len(benchmark_queries)} queries in {async_time:.2f}s '
+              f'({blocking_time / async_time:.1f}x), same results: {[r[:2] for r in async_results] == blocking_results}')
+
+        # and with the mock occasionally rate limiting / failing
+        cmr_query_utilities.CMR_COLLECTIONS_URL = errors_url
+        start = time.time()
+        get_top_cmr_datasets(benchmark_queries, max_in_flight=in_flight, backoff=0.01)
+        print(f'    with 5% 429/503 responses: {time.time() - start:.2f}s')
+        cmr_query_utilities.CMR_COLLECTIONS_URL = mock_url
@@ -0,0 +1,91 @@
+"""
+    Bulk mode for the science keyword CMR queries (run_CMR_query in sentence_label_utilities.py). Each valid couple is
+    queried once per science keyword, so a paper with P couples and S science keywords costs P x S queries. Here every GES
+    DISC collection of a platform/instrument/level is fetched once, page by page with its full science keyword metadata,
+    and the query for each science keyword is answered locally from that set with a LocalCMR (local_cmr_utility.py). The
+    queries then cost one fetch per platform/instrument/level (and per extra page) instead of one per science keyword.
+
+    BulkCMRCache has the same get/set/offline interface as CMRCache, so it is passed in wherever a CMR cache is (ie:
+    cmr_cache in run_keyword_sentences). The queries it can't answer from a collection set (free text keyword searches)
+    go on to the api as usual, through the CMR cache it wraps if there is one. The bulk pages go through that cache too.
+    The collections are kept in the order CMR returned them, so the results for each science keyword are the ones CMR
+    would have returned
+"""
+
+import json
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from CMR_Queries.cmr_query_utilities import query_cmr
+from CMR_Queries.local_cmr_utility import LocalCMR
+
+MAX_PAGE_SIZE = 2000  # the most collections CMR returns in one page
+
+# parameters that only change which page or how it is printed, not which collections match
+PAGING_PARAMETERS = {'page_size', 'page_num', 'pretty'}
+
+
+# science keyword filters and their options, the part of the query answered locally
+def is_science_keyword_parameter(name):
+    return name.startswith('science_keywords[') or name.startswith('options[science_keywords]')
+
+
+class BulkCMRCache:
+    # cache: optional CMRCache for the bulk pages and the queries that can't be answered locally
+    # page_size: collections per bulk page
+    def __init__(self, cache=None, page_size=MAX_PAGE_SIZE):
+        self.cache = cache
+        self.page_size = page_size
+        self.collection_sets = {}  # the query without its science keywords -> LocalCMR of the collections it returns
+        self.fetches, self.local_answers = 0, 0
+
+    @property
+    def offline(self):
+        return self.cache.offline if self.cache else False
+
+    # The url split into (the query for the collection set, the science keyword part), or None if the url can't be
+    # answered from a collection set
+    @staticmethod
+    def split_query(url):
+        parts = urlsplit(url)
+        parameters = parse_qsl(parts.query, keep_blank_values=True)
+        names = {name for name, _ in parameters}
+        if not any(name.startswith('science_keywords[') for name in names) or 'keyword' in names or 'author' in names:
+            return None
+        set_query = tuple(sorted((name, value) for name, value in parameters
+                                 if not is_science_keyword_parameter(name) and name not in PAGING_PARAMETERS))
+        local_query = [(name, value) for name, value in parameters
+                       if is_science_keyword_parameter(name) or name in PAGING_PARAMETERS]
+        return (parts.scheme, parts.netloc, parts.path, set_query), local_query
+
+    # Every collection the query returns (without its science keyword filters), fetched once page by page
+    def collection_set(self, key):
+        if key not in self.collection_sets:
+            scheme, netloc, path, set_query = key
+            path = path.replace('collections.json', 'collections.umm_json')
+            records, page_num = [], 1
+            while True:
+                page_query = urlencode(list(set_query) + [('page_size', self.page_size), ('page_num', page_num)])
+                data = query_cmr(f'{scheme}://{netloc}{path}?{page_query}', self.cache)
+                self.fetches += 1
+                records += [dict(item['umm'], ConceptId=item['meta']['concept-id']) for item in data['items']]
+                if len(data['items']) < self.page_size or len(records) >= data.get('hits', 0):
+                    break
+                page_num += 1
+            self.collection_sets[key] = LocalCMR(records, keep_order=True)
+        return self.collection_sets[key]
+
+    # Same as CMRCache.get: the body of the response for the url, from the collection set if it can be answered from
+    # one, otherwise from the wrapped cache (None if it isn't cached)
+    def get(self, url):
+        split = self.split_query(url)
+        if split is None:
+            return self.cache.get(url) if self.cache else None
+        key, local_query = split
+        self.local_answers += 1
+        return json.dumps(self.collection_set(key).search_page(local_query))
+
+    def set(self, url, body):
+        if self.cache:
+            self.cache.set(url, body)
+
+    def stats(self):
+        return {"bulk_fetches": self.fetches, "local_answers": self.local_answers, "collection_sets": len(self.collection_sets)}
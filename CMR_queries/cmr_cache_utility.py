@@ -0,0 +1,69 @@
+"""
+    On-disk cache for CMR responses. Used by cmr_query_utilities.py so that re-running the CMR queries over the same
+    papers (ie: from query_creator_utility.py when only the ranking changes) doesn't have to hit the API again
+"""
+
+import os
+import sqlite3
+import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+
+# Two urls that ask CMR the same thing should share a cache entry: lowercase the scheme/host and sort the parameters
+def normalize_url(url):
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True))
+    return f'{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path}?{urlencode(query)}'
+
+
+class CMRCache:
+    # location: sqlite file to store the responses in
+    # ttl: number of seconds a response stays valid. None means responses never expire
+    # offline: never go to the network. A query that isn't in the cache raises an error instead
+    def __init__(self, location='cmr_cache.sqlite', ttl=None, offline=False):
+        self.location = location
+        self.ttl = ttl
+        self.offline = offline
+        self.hits, self.misses = 0, 0
+        self._connection = None
+        self._pid = None
+
+    # sqlite connections can't be shared between processes, so each process (ie: each labelling worker) opens its own
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.location, timeout=60)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                                     '(url TEXT PRIMARY KEY, body TEXT NOT NULL, fetched_at REAL NOT NULL)')
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'], state['_pid'] = None, None
+        return state
+
+    # the body of the cached response for the url or None if it isn't cached (or has expired)
+    def get(self, url):
+        row = self.connection.execute('SELECT body, fetched_at FROM responses WHERE url = ?',
+                                      (normalize_url(url),)).fetchone()
+        if row is None or (self.ttl is not None and time.time() - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def set(self, url, body):
+        self.connection.execute('INSERT OR REPLACE INTO responses (url, body, fetched_at) VALUES (?, ?, ?)',
+                                (normalize_url(url), body, time.time()))
+        self.connection.commit()
+
+    def clear(self):
+        self.connection.execute('DELETE FROM responses')
+        self.connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
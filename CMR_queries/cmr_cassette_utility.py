@@ -0,0 +1,166 @@
+"""
+    Record and replay CMR traffic, so the CMR query code (get_top_cmr_dataset, run_CMR_query, update_cmr_values, the
+    async client) can be benchmarked and regression tested against the same responses every time, without the live api.
+
+    A CMRCassette has the same get/set/offline interface as CMRCache and is passed in as the CMR cache:
+        - record: every query goes to the api, and its url, response body and how long it took are kept. save() writes
+          them to a gzipped JSONL file (the cassette), one request per line
+        - replay: every query is answered from the cassette after a simulated latency, and nothing goes to the api. A query
+          that isn't in the cassette raises an error like an offline CMRCache
+    The latency is a number of seconds, or 'recorded' to wait as long as the request took when it was recorded.
+    To measure concurrency (ie: the async client in cmr_async_utility.py), serve the cassette over http with
+    start_mock_cmr_server(cassette=...) in mock_cmr_server.py so the simulated latencies overlap like real requests do.
+
+    Requests are matched on the path and the sorted parameters of the url, so a cassette recorded against CMR can be
+    replayed from a local server. Record with workers=1, each worker process would record into its own copy
+"""
+
+import gzip
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+
+# the part of the url that identifies a request: the path and the sorted parameters (not the host)
+def request_key(url):
+    parts = urlsplit(url)
+    return f'{parts.path}?{urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))}'
+
+
+class CMRCassette:
+    # location: the cassette file (gzipped JSONL)
+    # mode: 'record' or 'replay'
+    # latency: seconds to wait before answering each replayed request, or 'recorded'
+    def __init__(self, location='cmr_traffic.jsonl.gz', mode='replay', latency=0.0):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"mode should be 'record' or 'replay', not {mode}")
+        self.location = location
+        self.mode = mode
+        self.latency = latency
+        self.offline = mode == 'replay'
+        self.requests = {}  # request key -> {"url": ..., "body": ..., "elapsed": ...}
+        self.hits, self.misses = 0, 0
+        self._started = {}  # request key -> when the request was sent (record mode)
+
+        if mode == 'replay':
+            self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.mode == 'record':
+            self.save()
+
+    def load(self):
+        with gzip.open(self.location, 'rt', encoding='utf-8') as f:
+            for line in f:
+                request = json.loads(line)
+                self.requests[request_key(request['url'])] = request
+
+    def save(self):
+        directory = os.path.dirname(self.location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with gzip.open(self.location, 'wt', encoding='utf-8', compresslevel=9) as f:
+            for request in self.requests.values():
+                f.write(json.dumps(request, separators=(',', ':')) + '\n')
+
+    # seconds to wait before answering the request
+    def delay(self, url):
+        if self.latency == 'recorded':
+            request = self.requests.get(request_key(url))
+            return request['elapsed'] if request else 0.0
+        return self.latency
+
+    # the recorded body for the url, or None if it wasn't recorded. Doesn't wait
+    def body(self, url):
+        request = self.requests.get(request_key(url))
+        return request['body'] if request else None
+
+    # Same as CMRCache.get. When recording nothing is answered (so the query goes to the api), when replaying the recorded
+    # body is returned after the simulated latency
+    def get(self, url):
+        if self.mode == 'record':
+            self._started[request_key(url)] = time.perf_counter()
+            return None
+
+        body = self.body(url)
+        if body is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        delay = self.delay(url)
+        if delay:
+            time.sleep(delay)
+        return body
+
+    # the response from the api for the url (record mode)
+    def set(self, url, body):
+        if self.mode != 'record':
+            return
+        key = request_key(url)
+        started = self._started.pop(key, None)
+        self.requests[key] = {"url": url, "body": body,
+                              "elapsed": round(time.perf_counter() - started, 4) if started is not None else 0.0}
+
+    def stats(self):
+        return {"requests": len(self.requests), "hits": self.hits, "misses": self.misses,
+                "recorded_seconds": round(sum(request['elapsed'] for request in self.requests.values()), 2)}
+
+
+# Record the queries of the async client benchmark from a mock CMR, then replay them: through the cache interface one at
+# a time, and over http with the async client at a few concurrency levels
+if __name__ == '__main__':
+    from CMR_Queries import cmr_query_utilities
+    from CMR_Queries.cmr_async_utility import get_top_cmr_datasets
+    from CMR_Queries.mock_cmr_server import start_mock_cmr_server
+
+    cassette_location = 'cmr_results/benchmark_traffic.jsonl.gz'
+    species = ['o3', 'h2o', 'hno3', 'n2o', 'co', 'hcl', 'clo', 'so2', 'no2', 'bro']
+    benchmark_queries = [{"platform": platform, "instrument": instrument, "science_keyword": s, "num_results": 20,
+                          "science_keyword_search": search}
+                         for platform, instrument in [('aura', 'mls'), ('aura', 'omi'), (None, 'airs')]
+                         for s in species for search in [True, False]]
+
+    mock_server, mock_url = start_mock_cmr_server(latency=0.05)
+    cmr_query_utilities.CMR_COLLECTIONS_URL = mock_url
+    with CMRCassette(cassette_location, mode='record') as cassette:
+        recorded_results = [cmr_query_utilities.get_top_cmr_dataset(**q, cache=cassette)[:2] for q in benchmark_queries]
+    print(f'Recorded {cassette.stats()} to {cassette_location} ({os.path.getsize(cassette_location)} bytes)')
+    mock_server.shutdown()
+
+    cassette = CMRCassette(cassette_location, latency='recorded')
+    start = time.perf_counter()
+    replayed_results = [cmr_query_utilities.get_top_cmr_dataset(**q, cache=cassette)[:2] for q in benchmark_queries]
+    print(f'replay, one at a time: {time.perf_counter() - start:.2f}s, same results: {replayed_results == recorded_results}')
+
+    replay_server, replay_url = start_mock_cmr_server(cassette=cassette)
+    cmr_query_utilities.CMR_COLLECTIONS_URL = replay_url
+    for in_flight in [1, 8, 32]:
+        start = time.perf_counter()
+        async_results = get_top_cmr_datasets(benchmark_queries, max_in_flight=in_flight)
+        print(f'replay over http, max_in_flight={in_flight}: {time.perf_counter() - start:.2f}s, '
+              f'same results: {[r[:2] for r in async_results] == recorded_results}')
+    replay_server.shutdown()
+
+    # The recorded responses: how many bytes they are with and without pretty=true. Record a cassette from the live api
+    # (leave CMR_COLLECTIONS_URL alone) for real sizes, the mock's entries are only about as big as CMR's
+    bodies = [request['body'] for request in cassette.requests.values()]
+    pretty_bodies = [json.dumps(json.loads(body), indent=2) for body in bodies]
+    for name, kind in [('pretty', pretty_bodies), ('compact', bodies)]:
+        print(f'{name}: {sum(len(body.encode("utf-8")) for body in kind)} bytes, '
+              f'{sum(len(gzip.compress(body.encode("utf-8"))) for body in kind)} gzipped')
+
+    # Only the fields at the top level of the entries are read, never the same name in a nested object (here the first
+    # entry has no id but a link with one). Fails if the entries are read any other way
+    nested_body = json.dumps({"feed": {"id": "https://cmr.earthdata.nasa.gov/search/collections.json", "entry": [
+        {"short_name": "A", "links": [{"id": "link A", "short_name": "not A", "href": "https://example.com/{[\"id\": 1"}]},
+        {"short_name": "B", "id": "C2-GES_DISC", "links": [{"id": "link B"}], "score": 0.5}]}})
+    entries = cmr_query_utilities.parse_cmr_entries(nested_body, ('short_name', 'id', 'score'))
+    print('entries with an "id" in their links:', entries)
+    if (entries != [{"short_name": "A", "id": None, "score": None}, {"short_name": "B", "id": "C2-GES_DISC", "score": 0.5}]
+            or cmr_query_utilities.parse_cmr_short_names(nested_body) != ['A', 'B']):
+        sys.exit(1)
@@ -0,0 +1,108 @@
+"""
+    Run the CMR queries for a whole corpus at once. Many papers ask CMR the exact same thing (ie: every MLS paper queries
+    aura/mls + o3), so the queries planned for each paper are collected first, every unique query is run a single time and
+    then the results are copied back into each paper. Called from sentence_label_utilities.py and query_creator_utility.py,
+    which also share plan_paper_CMR_queries for the queries of each paper
+"""
+
+from copy import deepcopy
+from enum import Enum
+
+
+class QueryMode(Enum):
+    ALL = 0,  # all combinations of missions/instruments and science keywords
+    RESTRICTED = 1  # only mission/instruments in the same sentence
+
+
+# split something like aura/mls----level 3 into platform/ins: aura/mls and level: level 3
+def get_platform_instrument_level(vc):
+    platform_instrument = vc.split('----')
+    if len(platform_instrument) > 1:
+        level = platform_instrument[1]
+        platform_instrument = platform_instrument[0]
+    else:
+        platform_instrument = platform_instrument[0]
+        level = None
+
+    return platform_instrument, level
+
+
+# List the CMR queries one paper needs based on the features that were extracted from it. Each query is
+# (results key ('pairs' or 'singles'), platform/instrument, species, level)
+def plan_paper_CMR_queries(summary_stats, couples_to_species, instrument_to_species, query_mode=QueryMode.ALL):
+    cmr_plan = []
+
+    # Restricted - keywords must be in the same sentence
+    if query_mode == QueryMode.RESTRICTED:
+        for couple, dict_counts in couples_to_species.items():
+            platform_instrument, level = get_platform_instrument_level(couple)
+            for species, species_count in dict_counts.items():
+                if species_count <= 1:
+                    continue
+                cmr_plan.append(('pairs', platform_instrument, species, level))
+
+        instruments_in_pairs = [couple.split('/')[1] for couple in couples_to_species]
+        for instrument, dict_counts in instrument_to_species.items():
+            platform, level = None, None
+            # if instrument not in instruments_in_pairs:
+            for species, species_count in dict_counts.items():
+                if species_count <= 1:
+                    continue
+                cmr_plan.append(('singles', f'{platform}/{instrument}', species, level))
+
+    # Non-Restricted - any combinations of keywords accross the whole paper
+    elif query_mode == QueryMode.ALL:
+        for vc in summary_stats['valid_couples']:
+            platform_instrument, level = get_platform_instrument_level(vc)
+            for science_keyword in summary_stats['species']:
+                if summary_stats['species'][science_keyword] <= 1:
+                    continue
+                cmr_plan.append(('pairs', platform_instrument, science_keyword, level))
+
+        instruments_in_pairs = [vc.split('/')[1] for vc in summary_stats['valid_couples']]
+        platform, level = None, None
+        for instrument in summary_stats['single_instrument']:
+            if instrument not in instruments_in_pairs:
+                for science_keyword in summary_stats['species']:
+                    if summary_stats['species'][science_keyword] <= 1:
+                        continue
+                    cmr_plan.append(('singles', f'{platform}/{instrument}', science_keyword, level))
+
+    return cmr_plan
+
+
+# paper_to_plan: pdf_key -> list of planned queries as (results key ('pairs' or 'singles'), platform/instrument, species, level)
+# paper_to_cmr_results: pdf_key -> {"pairs": {}, "singles": {}} which gets filled in with the results
+# run_CMR_query: the function that runs one query and stores it in a results dictionary keyed by the query description
+def run_planned_CMR_queries(paper_to_plan, paper_to_cmr_results, run_CMR_query, sort_by_usage=False, cache=None):
+    unique_queries = {}  # (platform/instrument, species, level) -> (query description, results)
+    planned_count = 0
+    for plan in paper_to_plan.values():
+        for _, platform_instrument, species, level in plan:
+            planned_count += 1
+            unique_queries[(platform_instrument, species, level)] = None
+
+    for count, query in enumerate(unique_queries, start=1):
+        print(f'CMR query {count}/{len(unique_queries)}', query)
+        query_results = {}
+        platform_instrument, species, level = query
+        run_CMR_query(platform_instrument, species, level, query_results, sort_by_usage, cache)
+        unique_queries[query] = next(iter(query_results.items()))
+
+    # fan the results back out, in the same order the paper would have run them in. Every paper gets its own copy, as it
+    # would running the query itself, so changing one paper's results (ie: spot_update_features) doesn't change the others
+    for paper, plan in paper_to_plan.items():
+        for results_key, platform_instrument, species, level in plan:
+            query_str, query_results = unique_queries[(platform_instrument, species, level)]
+            paper_to_cmr_results[paper][results_key][query_str] = deepcopy(query_results)
+
+    # each planned query is two api calls: a science keyword search and a free text search
+    stats = {
+        "planned_queries": planned_count,
+        "unique_queries": len(unique_queries),
+        "network_calls": 2 * len(unique_queries),
+        "network_calls_saved": 2 * (planned_count - len(unique_queries))
+    }
+    print(f'Ran {stats["unique_queries"]} unique CMR queries for {stats["planned_queries"]} planned queries. '
+          f'Saved {stats["network_calls_saved"]} network calls')
+    return stats
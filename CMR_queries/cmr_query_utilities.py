@@ -6,48 +6,134 @@ This is the file actually used to run the cmr queries. It is called from sentenc
 import json
 import requests
 import re
+import time
 
+# collections search endpoint. Can be pointed to a local stand-in for CMR when testing
+CMR_COLLECTIONS_URL = 'https://cmr.earthdata.nasa.gov/search/collections.json'
 
-# The keywords in CMR are specific to the colleciton metadta. This function maps the current keywords to the CMR keyword
-def convert_science_keyword(science_keyword):
-    with open('../data/json/keywords.json', encoding='utf-8') as f:
-        keywords = json.load(f)
 
-    # detailed variables inside of CMR
-    with open('../data/json/species_to_variable_level.json', encoding='utf-8') as f:
-        cmr_keywords = json.load(f)
+# a few manual mappings to turn my keywords into cmr keywords
+MANUAL_SCIENCE_KEYWORD_MAPPINGS = {
+    "NO": "nitrous oxide",
+    "n2o": "nitrous oxide",
+    "hcl": "hydrogen chloride",
+    "rhi": "relative humidity",
+    "bro": "bromine monoxide"
+}
 
-    if science_keyword in cmr_keywords.keys():
-        return science_keyword
 
-    if keywords['variables']['short_to_long'].get(science_keyword, "").upper() in cmr_keywords:
-        return keywords['variables']['short_to_long'][science_keyword]
-
-    # a few manual mappings to turn my keywords into cmr keywords
-    manual_mappings = {
-        "NO": "nitrous oxide",
-        "n2o": "nitrous oxide",
-        "hcl": "hydrogen chloride",
-        "rhi": "relative humidity",
-        "bro": "bromine monoxide"
-    }
-    if science_keyword in manual_mappings:
-        science_keyword = manual_mappings[science_keyword]
+# species_to_variable_level.json level -> the science_keywords field for it in a CMR query
+VARIABLE_LEVEL_FIELDS = {
+    "VariableLevel1": "variable-level-1",
+    "VariableLevel2": "variable-level-2",
+    "VariableLevel3": "variable-level-3",
+    "DetailedVariable": "detailed-variable"
+}
+
+
+# The keywords in CMR are specific to the colleciton metadta. This maps the current keywords to the CMR keyword.
+# Both files are only read once and the mapping for every known short name is computed up front
+class ScienceKeywordResolver:
+    def __init__(self, keywords, cmr_keywords):
+        self.variables_short_to_long = keywords['variables']['short_to_long']
+        self.cmr_keywords = cmr_keywords  # detailed variables inside of CMR
+
+        self.mapping = {}
+        for science_keyword in list(self.variables_short_to_long) + list(MANUAL_SCIENCE_KEYWORD_MAPPINGS) + list(cmr_keywords):
+            self.mapping[science_keyword] = self._resolve(science_keyword)
+
+    @classmethod
+    def from_files(cls, keyword_file_location='../data/json/keywords.json',
+                   species_to_variable_level_location='../data/json/species_to_variable_level.json'):
+        with open(keyword_file_location, encoding='utf-8') as f:
+            keywords = json.load(f)
+
+        with open(species_to_variable_level_location, encoding='utf-8') as f:
+            cmr_keywords = json.load(f)
+
+        return cls(keywords, cmr_keywords)
+
+    def _resolve(self, science_keyword):
+        if science_keyword in self.cmr_keywords:
+            return science_keyword
+
+        if self.variables_short_to_long.get(science_keyword, "").upper() in self.cmr_keywords:
+            return self.variables_short_to_long[science_keyword]
+
+        if science_keyword in MANUAL_SCIENCE_KEYWORD_MAPPINGS:
+            return MANUAL_SCIENCE_KEYWORD_MAPPINGS[science_keyword]
+
+        # print("unresolved keyword ", science_keyword)
         return science_keyword
 
-    # print("unresolved keyword ", science_keyword)
-    return science_keyword
+    def resolve(self, science_keyword):
+        if science_keyword not in self.mapping:  # remember keywords that aren't in the files as well
+            self.mapping[science_keyword] = self._resolve(science_keyword)
+        return self.mapping[science_keyword]
 
+    # For a resolved keyword, the science_keywords field it is at in CMR (ie: variable-level-2) and the keyword as it is
+    # written in CMR (ie: OZONE). The field is None if the keyword isn't in species_to_variable_level.json
+    def variable_level(self, cmr_keyword):
+        for name in (cmr_keyword, cmr_keyword.upper()):
+            if name in self.cmr_keywords:
+                return VARIABLE_LEVEL_FIELDS.get(self.cmr_keywords[name]), name
+        return None, cmr_keyword
 
-# Actually make the CMR query
-def get_top_cmr_dataset(platform, instrument, science_keyword, science_keyword_search=True, num_results=1, level=None, author=None, resolutions=None, sort_by_usage=False):
+
+_default_resolver = None
+
+
+# The resolver used when one isn't passed in. Loaded from data/json the first time it is needed
+def get_default_resolver():
+    global _default_resolver
+    if _default_resolver is None:
+        _default_resolver = ScienceKeywordResolver.from_files()
+    return _default_resolver
+
+
+def convert_science_keyword(science_keyword, resolver=None):
+    if resolver is None:
+        resolver = get_default_resolver()
+    return resolver.resolve(science_keyword)
+
+
+# Call the api (or read the response from the cache if one is passed in) and return the body of the response
+def query_cmr_body(url, cache=None):
+    if cache:
+        body = cache.get(url)
+        if body is not None:
+            return body
+        if cache.offline:
+            print(url)
+            raise RuntimeWarning("CMR query is not in the cache and the cache is offline")
+
+    response = requests.get(url)
+    if response.status_code == 200:
+        if cache:
+            cache.set(url, response.text)
+        return response.text
+    print(url)
+    print("response code", response.status_code)
+    raise RuntimeWarning("Could not access CMR API")
+
+
+# Call the api (or read the response from the cache if one is passed in) and return the parsed json
+def query_cmr(url, cache=None):
+    return json.loads(query_cmr_body(url, cache))
+
+
+# Build the url for a CMR query along with a short string to describe what was queried
+# exact_science_keywords: search for the science keyword at its level in CMR (from species_to_variable_level.json) instead
+# of with a pattern on all the levels. Keywords whose level isn't known are still searched with the pattern
+def build_cmr_query(platform, instrument, science_keyword, science_keyword_search=True, num_results=1, level=None, author=None, resolutions=None, sort_by_usage=False, resolver=None,
+                    exact_science_keywords=False):
     if science_keyword == 't':
         science_keyword = 'temperature'
     elif science_keyword == "iwc":
         science_keyword = "cloud liquid water"
 
     # base cmr api url
-    url = f'https://cmr.earthdata.nasa.gov/search/collections.json?pretty=true&page_size={num_results}&page_num=1&has_granules=True&data_center=*GESDISC*&options[data_center][pattern]=true'
+    url = f'{CMR_COLLECTIONS_URL}?page_size={num_results}&page_num=1&has_granules=True&data_center=*GESDISC*&options[data_center][pattern]=true'
     if level:
         level = re.sub(r'level[ \-] ?', '', level)
         url += f'&processing_level_id[]={level}'
@@ -61,8 +147,14 @@ def get_top_cmr_dataset(platform, instrument, science_keyword, science_keyword_s
             query_string += f'&platform={platform}&options[platform][ignore-case]=true'
         if instrument:
             query_string += f'&instrument={instrument}&options[instrument][ignore-case]=true'
+        variable_level = None  # the science keyword's level in CMR, if it is searched for there exactly
         if science_keyword:
-            science_keyword = convert_science_keyword(science_keyword)
+            science_keyword = convert_science_keyword(science_keyword, resolver)
+            if exact_science_keywords:
+                variable_level, cmr_keyword = (resolver or get_default_resolver()).variable_level(science_keyword)
+        if variable_level:
+            query_string += f'&science_keywords[0][{variable_level}]={cmr_keyword}&options[science_keywords][ignore-case]=true'
+        elif science_keyword:
             query_string += f'&science_keywords[0][variable-level-1]=*{science_keyword}*' \
                             f'&science_keywords[1][variable-level-2]=*{science_keyword}*' \
                             f'&science_keywords[2][variable-level-3]=*{science_keyword}*' \
@@ -74,7 +166,7 @@ def get_top_cmr_dataset(platform, instrument, science_keyword, science_keyword_s
     # otherwise if searching just with free text, add the free text search to the base link
     else:
         if science_keyword:
-            science_keyword = convert_science_keyword(science_keyword)
+            science_keyword = convert_science_keyword(science_keyword, resolver)
         url += f'&keyword={platform if platform else ""}%20{instrument}%20{science_keyword}'
 
     # add in more parameters if they exist
@@ -87,27 +179,53 @@ def get_top_cmr_dataset(platform, instrument, science_keyword, science_keyword_s
     if sort_by_usage:
         url += '&sort_key[]=-usage_score'
 
-    # actually call the api
-    response = requests.get(url)
-    # print(url)
-    if response.status_code == 200:
-        data = response.json()
-    else:
-        print(url)
-        print("response code", response.status_code)
-        raise RuntimeWarning("Could not access CMR API")
+    # a short string to describe what was queried
+    query_description = f'{platform}/{instrument}_{science_keyword}'
+    if level:
+        query_description += f'-level {level}'
+
+    return url, query_description
+
 
-    # store all the datasets returned
+# store all the datasets returned by a query
+def parse_cmr_datasets(data):
     top_datasets = []
     for element in data['feed']['entry']:
         top_datasets.append(element['short_name'])  # dataset_id and title
+    return top_datasets
 
-    # a short string to describe what was queried
-    query_description = f'{platform}/{instrument}_{science_keyword}'
-    if level:
-        query_description += f'-level {level}'
 
-    return query_description, top_datasets, url
+# The values of one field (ie: short_name, id, score) of every entry in the body of a response. The entries without the
+# field are left out. Only the fields at the top level of the entries count, so the same name in a nested object (ie: an
+# "id" in the links) is never read. Reading the field straight out of the text isn't any faster than parsing the json
+# once it has to keep track of the nesting, so the whole body is parsed
+def parse_cmr_field(body, field='short_name'):
+    return [entry[field] for entry in json.loads(body)['feed']['entry'] if field in entry]
+
+
+# Same as parse_cmr_datasets on the body of the response
+def parse_cmr_short_names(body):
+    return parse_cmr_field(body, 'short_name')
+
+
+# A dict of the fields (ie: short_name, id, score) of each entry, from the body of the response. An entry without one of
+# the fields gets None for it
+def parse_cmr_entries(body, fields=('short_name', 'id')):
+    return [{field: entry.get(field) for field in fields} for entry in json.loads(body)['feed']['entry']]
+
+
+# Actually make the CMR query
+# resolver: optional ScienceKeywordResolver to turn the science keyword into the CMR keyword
+# exact_science_keywords: see build_cmr_query
+def get_top_cmr_dataset(platform, instrument, science_keyword, science_keyword_search=True, num_results=1, level=None, author=None, resolutions=None, sort_by_usage=False, cache=None, resolver=None,
+                        exact_science_keywords=False):
+    url, query_description = build_cmr_query(platform, instrument, science_keyword, science_keyword_search, num_results,
+                                             level, author, resolutions, sort_by_usage, resolver, exact_science_keywords)
+
+    # actually call the api
+    body = query_cmr_body(url, cache)
+
+    return query_description, parse_cmr_short_names(body), url
 
 
 # Just a method to test some of the functions in this file. This gets called from sentence_label_utilities
@@ -118,4 +236,31 @@ if __name__ == '__main__':
     print(result[1])
     print(result[2])
 
+    # Compare the exact science keyword queries with the wildcard ones: how long CMR takes to answer and how many of the
+    # same datasets come back. Species whose level isn't known send the same wildcard query both ways and are left out
+    couples = [('aura', 'mls'), ('aura', 'omi'), ('aqua', 'airs'), ('terra', 'modis')]
+    species = ['o3', 'h2o', 'hno3', 'n2o', 'co', 'hcl', 'clo', 'so2', 'no2', 'bro', 'ch4', 'aerosol']
+    elapsed = {True: 0.0, False: 0.0}
+    compared, same_top, overlaps = 0, 0, []
+    for platform, instrument in couples:
+        for s in species:
+            if get_default_resolver().variable_level(convert_science_keyword(s))[0] is None:
+                continue
+            datasets = {}
+            for exact in (True, False):
+                start = time.perf_counter()
+                datasets[exact] = get_top_cmr_dataset(platform, instrument, s, num_results=20, exact_science_keywords=exact)[1]
+                elapsed[exact] += time.perf_counter() - start
+            compared += 1
+            same_top += datasets[True][:1] == datasets[False][:1]
+            union = set(datasets[True]) | set(datasets[False])
+            overlaps.append(len(set(datasets[True]) & set(datasets[False])) / len(union) if union else 1.0)
+            print(f'{platform}/{instrument} {s}: {len(datasets[True])} exact, {len(datasets[False])} wildcard, '
+                  f'{len(datasets[False]) - len(set(datasets[False]) & set(datasets[True]))} only from the wildcards')
+
+    if compared:
+        print(f'{compared} queries. exact: {elapsed[True] / compared * 1000:.0f}ms per query, '
+              f'wildcard: {elapsed[False] / compared * 1000:.0f}ms per query')
+        print(f'same top dataset: {same_top / compared:.0%}, mean overlap of the top 20: {sum(overlaps) / compared:.0%}')
+
 
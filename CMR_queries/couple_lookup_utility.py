@@ -0,0 +1,56 @@
+"""
+    The mission/instrument couples file (mission_instrument_couples_LOWER.json) compiled once into sets, so checking which
+    of the missions and instruments in a sentence form valid couples is a set intersection instead of a list scan for every
+    pair. Called from sentence_label_utilities.py. Can also hold couples_to_datasets.json, keyed the same way
+"""
+
+import json
+from collections import defaultdict
+
+
+class CoupleLookup:
+    # couples: mission -> list of instruments (ie: the contents of mission_instrument_couples_LOWER.json)
+    # couples_to_datasets: optional 'mission:instrument' (or just 'mission') -> list of dataset names
+    def __init__(self, couples, couples_to_datasets=None):
+        self.couples = couples
+        self.mission_to_instruments = {mission: frozenset(instruments) for mission, instruments in couples.items()}
+        self.pairs = frozenset((mission, instrument) for mission, instruments in couples.items() for instrument in instruments)
+
+        instrument_to_missions = defaultdict(set)  # reverse index
+        for mission, instrument in self.pairs:
+            instrument_to_missions[instrument].add(mission)
+        self.instrument_to_missions = {instrument: frozenset(missions) for instrument, missions in instrument_to_missions.items()}
+
+        self.pair_to_datasets = {}  # (mission, instrument or None) -> dataset names
+        for tag, datasets in (couples_to_datasets or {}).items():
+            mission, _, instrument = tag.partition(':')
+            self.pair_to_datasets[(mission, instrument or None)] = datasets
+
+    @classmethod
+    def from_files(cls, couples_location, couples_to_datasets_location=None):
+        with open(couples_location, encoding='utf-8') as f:
+            couples = json.load(f)
+        couples_to_datasets = None
+        if couples_to_datasets_location:
+            with open(couples_to_datasets_location, encoding='utf-8') as f:
+                couples_to_datasets = json.load(f)
+        return cls(couples, couples_to_datasets)
+
+    def is_valid(self, mission, instrument):
+        return (mission, instrument) in self.pairs
+
+    # every (mission, instrument) couple that can be made from the missions and instruments, in no particular order
+    def valid_couples(self, missions, instruments):
+        instruments = set(instruments)
+        couples = []
+        for mission in set(missions):
+            for instrument in self.mission_to_instruments.get(mission, frozenset()) & instruments:
+                couples.append((mission, instrument))
+        return couples
+
+    def missions_for_instrument(self, instrument):
+        return self.instrument_to_missions.get(instrument, frozenset())
+
+    # instrument=None for datasets that are only tagged with a mission
+    def datasets(self, mission, instrument=None):
+        return self.pair_to_datasets.get((mission, instrument), [])
@@ -0,0 +1,55 @@
+"""
+    Bookkeeping for incremental labelling runs (called from run_keyword_sentences in sentence_label_utilities.py).
+    A manifest records, for every pdf_key, the hash of its preprocessed text and the hash of the inputs (keywords file,
+    couples file and labelling settings) its features were made with. Papers whose hashes haven't changed can reuse their
+    previous features instead of being labelled again
+"""
+
+import hashlib
+import json
+import os
+
+
+def hash_file(location):
+    with open(location, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+# one hash for everything (other than the paper's text) that changes the features of a paper
+def hash_inputs(keyword_file_location, mission_instrument_couples, **settings):
+    h = hashlib.sha256()
+    for location in [keyword_file_location, mission_instrument_couples]:
+        with open(location, 'rb') as f:
+            h.update(f.read())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+# pdf_key -> {"text_hash": ..., "inputs_hash": ...}
+def load_manifest(manifest_location):
+    if not os.path.exists(manifest_location):
+        return {}
+    with open(manifest_location, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_location, manifest):
+    with open(manifest_location, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4)
+
+
+# Hash the text of every paper and split out the ones that can keep their previous results
+# returns the unchanged papers (pdf_key -> previous results) and pdf_key -> text hash for all the papers
+def find_unchanged_papers(papers, preprocessed_directory, manifest, inputs_hash, previous_results):
+    unchanged, text_hashes = {}, {}
+    for paper in papers:
+        try:
+            text_hashes[paper] = hash_file(preprocessed_directory + paper + '.txt')
+        except FileNotFoundError:
+            continue
+
+        entry = manifest.get(paper, {})
+        if paper in previous_results and entry.get('text_hash') == text_hashes[paper] and entry.get('inputs_hash') == inputs_hash:
+            unchanged[paper] = previous_results[paper]
+
+    return unchanged, text_hashes
@@ -0,0 +1,356 @@
+"""
+    This gets called from sentence_label_utilities to find the missions, instruments, models and species in a sentence.
+    All the short and long names from the keywords file are compiled once into a single Aho-Corasick automaton, so each
+    sentence is scanned one time instead of once per keyword
+
+    Regex keyword files (keyword_optimization/keywords_regex_revised.json, made by create_regex_keyword_file.py) have long
+    names like 'advanced microwave sounding unit(?: |\\-)?a'. When a file has any of these, all the long names are
+    compiled into one alternation (longest first, one named group per long name) and substituted in a single pass
+"""
+
+import re
+import json
+from bisect import bisect_right
+from collections import defaultdict, deque
+from CMR_Queries.author_spatial_labeling_utility import AuthorIndex
+from CMR_Queries.regex_utility import ASCII_LETTERS, REGEX_SPECIAL_CHARACTERS, trie_pattern
+
+NO_PATTERN = re.compile(r'[^a-zA-Z]NO[^a-zA-Z]')
+VARIANT_MARKER = '(?:'  # create_regex_keyword_file.py writes the optional hyphens and slashes as (?: |\-)? and (?: |/)?
+VARIANT_GROUP = re.compile(r'\(\?:[^)]*\)\?')
+
+# order matters: the long names are substituted in this order, just like the original loops in substitute_keywords
+CATEGORIES = ['missions', 'instruments', 'models', 'variables']
+
+# where the names found in each category are stored. Note that long model names are recorded as instruments
+SHORT_NAME_DESTINATION = {'missions': 'missions', 'instruments': 'instruments', 'models': 'models', 'variables': 'species'}
+LONG_NAME_DESTINATION = {'missions': 'missions', 'instruments': 'instruments', 'models': 'instruments', 'variables': 'species'}
+
+
+def is_variant_name(long_name):
+    return VARIANT_MARKER in long_name
+
+
+# A regex long name split into tokens: one per character, and one per optional hyphen/slash group. Everything other than
+# those groups is plain text (ie: the parentheses in 'earth observing system, terra (am(?: |\-)?1)')
+def _variant_tokens(long_name):
+    tokens, position = [], 0
+    for group in VARIANT_GROUP.finditer(long_name):
+        tokens += [re.escape(char) for char in long_name[position:group.start()]]
+        tokens.append(group.group())
+        position = group.end()
+    return tokens + [re.escape(char) for char in long_name[position:]]
+
+
+# The regex for a long name from a regex keyword file
+def variant_pattern(long_name):
+    return ''.join(_variant_tokens(long_name))
+
+
+# Regex for all the long names, written as a trie of tokens like trie_pattern. The end of long_names[i] is marked by an
+# empty group 'n<i>', so match.lastgroup says which one matched. At every branch the branch with the longest name in it
+# is tried first, and a name only ends where no longer name continues, so the longest name wins
+def _long_name_pattern(long_names):
+    trie = {}
+    for index, long_name in long_names:
+        node = trie
+        for token in _variant_tokens(long_name) if is_variant_name(long_name) else [re.escape(char) for char in long_name]:
+            node = node.setdefault(token, {})
+        node.setdefault('', index)  # the same text twice: the first one in substitution order is the one that is used
+
+    def longest(node):
+        return max((1 + longest(child) for token, child in node.items() if token != ''), default=0)
+
+    def node_pattern(node):
+        children = sorted(((token, child) for token, child in node.items() if token != ''), key=lambda item: -longest(item[1]))
+        branches = [token + node_pattern(child) for token, child in children]
+        if '' in node:
+            branches.append(f'(?P<n{node[""]}>)')
+        return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+    return node_pattern(trie) if trie else '(?!)'
+
+
+class TokenPrefilter:
+    # Decides with one set intersection (and a substring search for the few names that have no whole word in them) if a
+    # sentence could get a keyword_count >= 1 from KeywordMatcher.match(). The sentences it rejects have no mission,
+    # instrument or model name, so they can be skipped without changing the results
+    # short_names / long_names: the mission, instrument and model names (regexes included). The variable long names are
+    # substituted after all of these, so they can never make one of them appear
+    def __init__(self, short_names, long_names):
+        self.letters = re.compile(r'[a-z]+')
+        self.word_to_required = defaultdict(list)  # word -> the words that have to be in the sentence along with it
+        literals, regexes = [], []
+
+        # a short name is matched between two non-letters, so its first run of letters is a whole word of the sentence
+        for short_name in short_names:
+            if REGEX_SPECIAL_CHARACTERS.intersection(short_name):
+                regexes.append(rf'[^a-zA-Z]{short_name}[^a-zA-Z\-]')
+            elif short_name[0] in ASCII_LETTERS:
+                self.word_to_required[self.letters.match(short_name.lower()).group()].append(frozenset())
+            else:
+                literals.append(short_name)
+
+        # a long name can start or end in the middle of a word, but the runs of letters with a non-letter on both sides
+        # (ie: 'limb' in 'microwave limb sounder') are always whole words. Names without any are searched for as they are
+        for long_name in long_names:
+            if is_variant_name(long_name):
+                regexes.append(variant_pattern(long_name))
+                continue
+            inner_words = {match.group() for match in self.letters.finditer(long_name)
+                           if 0 < match.start() and match.end() < len(long_name)
+                           and long_name[match.start() - 1] not in ASCII_LETTERS and long_name[match.end()] not in ASCII_LETTERS}
+            if inner_words:
+                self.word_to_required[max(inner_words, key=len)].append(frozenset(inner_words))
+            else:
+                literals.append(long_name)
+
+        self.words = frozenset(self.word_to_required)
+        self.fallback = re.compile(trie_pattern(literals, regexes)) if literals or regexes else None
+        self.checked, self.rejected = 0, 0  # for the rejection rate
+
+    def could_match(self, sentence):
+        lowercase_sentence = sentence.lower()
+        self.checked += 1
+        sentence_words = set(self.letters.findall(lowercase_sentence))
+        for word in self.words.intersection(sentence_words):
+            if any(required <= sentence_words for required in self.word_to_required[word]):
+                return True
+        if self.fallback is not None and self.fallback.search(lowercase_sentence):
+            return True
+        self.rejected += 1
+        return False
+
+    def rejection_rate(self):
+        return self.rejected / self.checked if self.checked else 0.0
+
+
+class KeywordMatcher:
+    # Build the automaton once from the keywords dictionary (ie: the contents of data/json/keywords.json)
+    def __init__(self, keywords):
+        self.keywords = keywords
+
+        self.patterns = []  # every literal string in the automaton
+        self.pattern_ids = {}
+        self.pattern_to_short = defaultdict(list)  # pattern id -> categories where the pattern is a short name
+        self.pattern_to_long = defaultdict(list)  # pattern id -> indices into long_names
+
+        # short names with regex characters (ie: 'npoess (national ...)') can't be matched literally, so they keep their
+        # own compiled pattern
+        self.regex_short_names = []
+        self.long_names = []  # (category, long name compiled pattern, short name) in substitution order
+        self.variant_names = []  # indices into long_names of the regex long names
+        self.variant_patterns = {}  # regex long name -> compiled variant_pattern
+
+        for category in CATEGORIES:
+            for short_name in keywords[category]['short_to_long']:
+                if short_name == '' or (category == 'instruments' and short_name == 'not applicable'):
+                    continue
+                if REGEX_SPECIAL_CHARACTERS.intersection(short_name):
+                    self.regex_short_names.append((category, short_name, re.compile(rf'[^a-zA-Z]{short_name}[^a-zA-Z\-]')))
+                else:
+                    self.pattern_to_short[self._add_pattern(short_name)].append(category)
+
+        for category in CATEGORIES:
+            for long_name, short_name in keywords[category]['long_to_short'].items():
+                if long_name == '':
+                    continue
+                if is_variant_name(long_name):
+                    self.variant_names.append(len(self.long_names))
+                    self.variant_patterns[long_name] = re.compile(variant_pattern(long_name))
+                else:
+                    self.pattern_to_long[self._add_pattern(long_name)].append(len(self.long_names))
+                self.long_names.append((category, re.compile(rf'{long_name}'), short_name))
+
+        self.pattern_lengths = [len(p) for p in self.patterns]
+
+        # one regex over the whole paper that finds every position where a mission, instrument or model name (the names
+        # that add to the keyword count in match()) starts. Used by keyword_sentence_indices
+        short_names = [self.patterns[pattern_id] for pattern_id, categories in self.pattern_to_short.items()
+                       if any(category != 'variables' for category in categories)]
+        regex_names = [short_name for category, short_name, _ in self.regex_short_names if category != 'variables']
+        long_names = [self.patterns[pattern_id] for pattern_id, indices in self.pattern_to_long.items()
+                      if any(self.long_names[i][0] != 'variables' for i in indices)]
+        variant_names = [variant_pattern(self.long_names[i][1].pattern) for i in self.variant_names if self.long_names[i][0] != 'variables']
+        self.keyword_scanner = re.compile(rf'(?=(?P<short>[^a-zA-Z]{trie_pattern(short_names, regex_names)}[^a-zA-Z\-])|(?P<long>{trie_pattern(long_names, variant_names)}))')
+
+        # every long name in one regex (see _long_name_pattern). The plain names are matched literally, like the
+        # `long_name in sentence` check always did
+        self.long_name_scanner = re.compile(_long_name_pattern((i, pattern.pattern) for i, (_, pattern, _) in enumerate(self.long_names)))
+        self.prefilter = TokenPrefilter(short_names + regex_names, [pattern.pattern for category, pattern, _ in self.long_names if category != 'variables'])
+        self.transitions, self.outputs = self._build_automaton()
+
+        # the author names are looked up separately (label_author), but built once here along with everything else
+        self.author_index = AuthorIndex(keywords['author_last_names'])
+
+    @classmethod
+    def from_file(cls, keyword_file_location):
+        with open(keyword_file_location, encoding='utf-8') as f:
+            keywords = json.load(f)
+        return cls(keywords)
+
+    def _add_pattern(self, pattern):
+        if pattern not in self.pattern_ids:
+            self.pattern_ids[pattern] = len(self.patterns)
+            self.patterns.append(pattern)
+        return self.pattern_ids[pattern]
+
+    # Trie + failure links, flattened into a full transition table so scanning is one dict lookup per character
+    def _build_automaton(self):
+        goto, outputs = [{}], [[]]
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                if char not in goto[state]:
+                    goto[state][char] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                state = goto[state][char]
+            outputs[state].append(pattern_id)
+
+        fail = [0] * len(goto)
+        transitions = [None] * len(goto)
+        transitions[0] = dict(goto[0])
+        queue = deque(goto[0].values())
+        while queue:  # breadth first, so the failure state of a node is always finished before the node itself
+            state = queue.popleft()
+            transitions[state] = {**transitions[fail[state]], **goto[state]}
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            for char, child in goto[state].items():
+                fail[child] = transitions[fail[state]].get(char, 0)
+                queue.append(child)
+
+        return transitions, [tuple(o) for o in outputs]
+
+    # One pass over the text. Returns pattern id -> start index of every (possibly overlapping) occurrence
+    def scan(self, text):
+        transitions, outputs, lengths = self.transitions, self.outputs, self.pattern_lengths
+        hits = defaultdict(list)
+        state = 0
+        for index, char in enumerate(text):
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                for pattern_id in outputs[state]:
+                    hits[pattern_id].append(index + 1 - lengths[pattern_id])
+        return hits
+
+    # Same count as len(re.findall(rf'[^a-zA-Z]{name}[^a-zA-Z\-]', text)): the match includes the boundary character
+    # on both sides and findall does not allow matches to overlap
+    @staticmethod
+    def _count_bounded(text, starts, length):
+        count, next_free = 0, 0
+        for start in starts:
+            end = start + length
+            if start - 1 < next_free or end >= len(text):
+                continue
+            if text[start - 1] in ASCII_LETTERS or text[end] in ASCII_LETTERS or text[end] == '-':
+                continue
+            count += 1
+            next_free = end + 1
+        return count
+
+    # Scan a whole paper in one pass instead of sentence by sentence. Returns the (sorted) indices of the sentences that
+    # have a mission, instrument or model name in them. Every sentence match() gives a keyword_count >= 1 is included, so
+    # the other sentences can be skipped without changing the results
+    def keyword_sentence_indices(self, sentences):
+        boundaries = []  # where each sentence starts in the joined text
+        position = 1
+        for sentence in sentences:
+            boundaries.append(position)
+            position += len(sentence) + 1
+        # each sentence is padded with spaces in match(), joining them with spaces keeps the same characters around them
+        text = (" " + " ".join(sentences) + " ").lower()
+
+        spans = []  # (start, end) offsets of the keyword hits in the joined text
+        for match in self.keyword_scanner.finditer(text):
+            if match.group('short') is not None:
+                spans.append((match.start('short') + 1, match.end('short') - 1))
+            else:
+                spans.append(match.span('long'))
+
+        # a hit (with the characters on either side of it) could belong to the sentences on both sides of a space
+        indices = set()
+        for start, end in spans:
+            indices.update(range(max(bisect_right(boundaries, start - 1) - 1, 0), bisect_right(boundaries, end)))
+        return sorted(indices)
+
+    # Every long name (regex variants included) in the lowercase sentence, with the variant that matched. Returns the
+    # sentence with the long names replaced by their short names, and for each replacement the category, short name, long
+    # name (the pattern from the keywords file) and the text it matched (ie: 'advanced microwave sounding unit a')
+    def substitute_long_names(self, lowercase_sentence):
+        matches = []
+
+        def replace(match):
+            category, pattern, short_name = self.long_names[int(match.lastgroup[1:])]
+            matches.append({"category": category, "short_name": short_name, "long_name": pattern.pattern, "matched": match.group()})
+            return short_name
+
+        return self.long_name_scanner.sub(replace, lowercase_sentence), matches
+
+    def _pending_long_names(self, hits, after=-1):
+        return sorted({i for pattern_id in hits for i in self.pattern_to_long.get(pattern_id, ()) if i > after})
+
+    # in the sentence, find the short names and convert all long names to short names (ie 'microwave limb sounder' -> 'mls')
+    # returns the same values substitute_keywords used to compute with one regex per keyword
+    def match(self, sentence):
+        keyword_count = 0
+        found = {'missions': set(), 'instruments': set(), 'models': set(), 'species': set()}
+
+        sentence = " " + sentence + " "  # to make the boundary rules work at beginning/end of lines
+
+        # Check for 'NO' (as in Nitrogen Oxide) before we lowercase the sentence which is different than the english word no
+        if NO_PATTERN.search(sentence):
+            found['species'].add('NO')
+
+        lowercase_sentence = sentence.lower()
+        hits = self.scan(lowercase_sentence)
+
+        # short names are all matched against the sentence before any long names are substituted
+        for pattern_id, starts in hits.items():
+            categories = self.pattern_to_short.get(pattern_id)
+            if not categories:
+                continue
+            short_matches = self._count_bounded(lowercase_sentence, starts, self.pattern_lengths[pattern_id])
+            if short_matches == 0:
+                continue
+            for category in categories:
+                found[SHORT_NAME_DESTINATION[category]].add(self.patterns[pattern_id])
+                if category != 'variables':
+                    keyword_count += short_matches
+
+        for category, short_name, pattern in self.regex_short_names:
+            short_matches = pattern.findall(lowercase_sentence)
+            if len(short_matches) > 0:
+                found[SHORT_NAME_DESTINATION[category]].add(short_name)
+            if category != 'variables':
+                keyword_count += len(short_matches)
+
+        # regex keyword file: all the long names are substituted in one pass, each one found adds 1 like below
+        if self.variant_names:
+            lowercase_sentence, long_matches = self.substitute_long_names(lowercase_sentence)
+            for category, _, short_name in {(m["category"], m["long_name"], m["short_name"]) for m in long_matches}:
+                if category != 'variables':
+                    keyword_count += 1
+                found[LONG_NAME_DESTINATION[category]].add(short_name)
+            return lowercase_sentence, keyword_count, found['missions'], found['instruments'], found['species'], found['models']
+
+        # Look for long names. Each substitution changes the sentence, so rescan it to see which of the remaining long
+        # names are still present
+        pending = self._pending_long_names(hits)
+        position = 0
+        while position < len(pending):
+            index = pending[position]
+            position += 1
+            category, pattern, short_name = self.long_names[index]
+            if category != 'variables':
+                keyword_count += 1
+            found[LONG_NAME_DESTINATION[category]].add(short_name)
+
+            substituted = pattern.sub(short_name, lowercase_sentence)  # replace long name with short name
+            if substituted != lowercase_sentence:
+                lowercase_sentence = substituted
+                pending = self._pending_long_names(self.scan(lowercase_sentence), after=index)
+                position = 0
+
+        return lowercase_sentence, keyword_count, found['missions'], found['instruments'], found['species'], found['models']
+
@@ -0,0 +1,245 @@
+"""
+    A local search engine over the GES DISC collection metadata files (the UMM-C json files the run_once scripts read for
+    the Platforms, Instruments and ScienceKeywords), so CMR queries can be answered offline without any rate limits.
+
+    LocalCMR keeps an inverted index from platform, instrument, processing level, data center, author, the science keyword
+    levels and the free text words of each collection to the collections that have them, and answers the queries built by
+    build_cmr_query in cmr_query_utilities.py with a ranked list of short names. It has the same get/set/offline interface
+    as CMRCache, so it can be passed in anywhere a CMR cache is (ie: cmr_cache in run_keyword_sentences) to label fully
+    offline. It can also be served over http by mock_cmr_server.py as a stand-in for the real api.
+
+    The ranking follows CMR where it can: free text queries are ranked by how well the words match (short name and title
+    before platform/instrument/science keywords before the abstract), other queries by entry title, and
+    sort_key[]=-usage_score by the usage scores that are passed in. has_granules isn't in the metadata and is ignored
+"""
+
+import json
+import glob
+import os
+import re
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qsl
+
+SCIENCE_KEYWORD_FIELDS = {'category': 'Category', 'topic': 'Topic', 'term': 'Term', 'variable-level-1': 'VariableLevel1',
+                          'variable-level-2': 'VariableLevel2', 'variable-level-3': 'VariableLevel3',
+                          'detailed-variable': 'DetailedVariable'}
+
+# how much a free text word counts for in each part of the metadata
+TEXT_WEIGHTS = {'short_name': 1.4, 'entry_title': 1.4, 'platform': 1.2, 'instrument': 1.2, 'science_keywords': 1.2,
+                'processing_level_id': 1.0, 'abstract': 0.3}
+
+
+# the words of some free text. Free text queries are split the same way
+def text_words(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+# Turn a CMR pattern (* is any number of characters, ? is one character) into a regex
+def pattern_regex(pattern):
+    return re.compile(''.join('.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern), re.DOTALL)
+
+
+def _instrument_names(instrument):
+    yield instrument.get('ShortName', '')
+    for child in instrument.get('ComposedOf', []) or []:  # CMR also finds a collection by its child instruments
+        yield from _instrument_names(child)
+
+
+class LocalCMR:
+    # records: the UMM-C metadata of each collection (ie: the json files in the datasets directory). The concept id is
+    # read from ConceptId if the record has one
+    # usage_scores: optional short name -> usage score, for sort_key[]=-usage_score
+    # keep_order: rank the collections in the order of the records (ie: the order CMR returned them in) instead of by title
+    def __init__(self, records, usage_scores=None, keep_order=False):
+        self.records = []
+        self.collections = []  # id -> {"id": concept id, "short_name": ..., "title": ..., "version_id": ...}
+        self.postings = {}  # field -> lowercase value -> collection ids
+        self.text_postings = {}  # free text word -> collection id -> weight
+        self.offline = True
+        self.hits, self.misses = 0, 0
+        self._patterns = {}  # (field, pattern) -> collection ids
+
+        for record in records:
+            self.add_collection(record)
+
+        usage_scores = usage_scores or {}
+        title_order = range(len(self.collections)) if keep_order else sorted(range(len(self.collections)),
+                                                                               key=lambda i: self.collections[i]['title'].lower())
+        self.title_rank = {i: rank for rank, i in enumerate(title_order)}
+        self.usage = {i: usage_scores.get(collection['short_name'], 0) for i, collection in enumerate(self.collections)}
+
+    # dataset_directory: the directory with one UMM-C json file per collection
+    @classmethod
+    def from_directory(cls, dataset_directory, usage_scores=None):
+        records = []
+        for file in sorted(glob.glob(os.path.join(dataset_directory, '*.json'))):
+            with open(file, encoding='utf-8', errors='ignore') as f:
+                record = json.load(f)
+            record.setdefault('ConceptId', os.path.splitext(os.path.basename(file))[0])
+            records.append(record)
+        return cls(records, usage_scores)
+
+    def add_collection(self, record):
+        i = len(self.collections)
+        self.records.append(record)
+        short_name = record.get('ShortName', '')
+        self.collections.append({"id": record.get('ConceptId', short_name), "short_name": short_name,
+                                 "title": record.get('EntryTitle', ''), "version_id": record.get('Version', '')})
+
+        fields = defaultdict(set)  # field -> values of this collection
+        fields['short_name'].add(short_name)
+        fields['processing_level_id'].add((record.get('ProcessingLevel') or {}).get('Id', ''))
+        for data_center in record.get('DataCenters', []) or []:
+            fields['data_center'].add(data_center.get('ShortName', ''))
+        for platform in record.get('Platforms', []) or []:
+            fields['platform'].add(platform.get('ShortName', ''))
+            for instrument in platform.get('Instruments', []) or []:
+                fields['instrument'].update(_instrument_names(instrument))
+        for science_keyword in record.get('ScienceKeywords', []) or []:
+            for field, key in SCIENCE_KEYWORD_FIELDS.items():
+                if science_keyword.get(key):
+                    fields[field].add(science_keyword[key])
+        for person in (record.get('ContactPersons', []) or []) + [contact for data_center in record.get('DataCenters', []) or []
+                                                                  for contact in data_center.get('ContactPersons', []) or []]:
+            fields['author'].add(person.get('LastName', ''))
+        for citation in record.get('CollectionCitations', []) or []:
+            fields['author'].add(citation.get('Creator', ''))
+
+        for field, values in fields.items():
+            for value in values:
+                if value:
+                    self.postings.setdefault(field, {}).setdefault(value.lower(), set()).add(i)
+
+        # free text: each word counts with the weight of the best part of the metadata it is in
+        texts = {'short_name': short_name, 'entry_title': record.get('EntryTitle', ''), 'abstract': record.get('Abstract', ''),
+                 'platform': ' '.join(fields['platform']), 'instrument': ' '.join(fields['instrument']),
+                 'processing_level_id': ' '.join(fields['processing_level_id']),
+                 'science_keywords': ' '.join(value for field in SCIENCE_KEYWORD_FIELDS for value in fields[field])}
+        for part, text in texts.items():
+            for word in text_words(text):
+                word_postings = self.text_postings.setdefault(word, {})
+                if word_postings.get(i, 0) < TEXT_WEIGHTS[part]:
+                    word_postings[i] = TEXT_WEIGHTS[part]
+
+    # the collections with a value of the field equal to value or matching it as a pattern. Case is always ignored
+    def matching(self, field, value, pattern=False):
+        values = self.postings.get(field, {})
+        value = value.lower()
+        if not pattern or ('*' not in value and '?' not in value):
+            return values.get(value, set())
+
+        if (field, value) not in self._patterns:  # the distinct values of a field are few, try the pattern on each once
+            regex = pattern_regex(value)
+            self._patterns[(field, value)] = set().union(*[ids for v, ids in values.items() if regex.fullmatch(v)])
+        return self._patterns[(field, value)]
+
+    # the collections with all the free text words, and how well each one matches
+    def text_scores(self, text):
+        scores = None
+        for word in text_words(text):
+            word_scores = self.text_postings.get(word, {})
+            if scores is None:
+                scores = dict(word_scores)
+            else:
+                scores = {i: score + word_scores[i] for i, score in scores.items() if i in word_scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+    # Answer a query given as a list of (parameter, value) pairs (the query string of a CMR collections url). Returns the
+    # ranked ids of the matching collections (all of them, before paging)
+    def search_parameters(self, parameters):
+        options = {name: value.lower() == 'true' for name, value in parameters if name.startswith('options[')}
+        filters = []  # sets of collection ids, every one of them has to match
+        science_keyword_filters = []
+        free_text = []
+        sort_by_usage = False
+
+        for name, value in parameters:
+            if name in ('data_center', 'platform', 'instrument', 'author', 'processing_level_id[]', 'processing_level_id'):
+                field = name.rstrip('[]')
+                filters.append(self.matching(field, value, options.get(f'options[{field}][pattern]', False)))
+            elif name.startswith('science_keywords['):
+                field = name.split('][')[-1].rstrip(']')
+                science_keyword_filters.append(self.matching(field, value, options.get('options[science_keywords][pattern]', False)))
+            elif name == 'keyword':
+                free_text.append(value)
+            elif name in ('sort_key[]', 'sort_key') and value == '-usage_score':
+                sort_by_usage = True
+
+        if science_keyword_filters:
+            if options.get('options[science_keywords][or]', False):
+                filters.append(set().union(*science_keyword_filters))
+            else:
+                filters.extend(science_keyword_filters)
+
+        scores = self.text_scores(' '.join(free_text)) if free_text else None
+        if scores is not None:
+            filters.append(scores.keys())
+
+        if filters:
+            filters.sort(key=len)
+            matches = set(filters[0]).intersection(*filters[1:])
+        else:
+            matches = set(range(len(self.collections)))
+
+        if sort_by_usage:
+            return sorted(matches, key=lambda i: (-self.usage[i], self.title_rank[i]))
+        if scores is not None:
+            return sorted(matches, key=lambda i: (-scores[i], self.title_rank[i]))
+        return sorted(matches, key=self.title_rank.__getitem__)
+
+    # The page of collections a CMR collections url would return, in the collections.json format (or the umm_json format
+    # with the full metadata for a collections.umm_json url)
+    def search(self, url):
+        parts = urlsplit(url)
+        return self.search_page(parse_qsl(parts.query, keep_blank_values=True), umm=parts.path.endswith('.umm_json'))
+
+    # same as search, with the query as a list of (parameter, value) pairs
+    def search_page(self, parameters, umm=False):
+        page_size = int(dict(parameters).get('page_size', 10))
+        page_num = int(dict(parameters).get('page_num', 1))
+        ranked = self.search_parameters(parameters)
+        page = ranked[(page_num - 1) * page_size:page_num * page_size]
+        if umm:
+            return {"hits": len(ranked), "items": [{"meta": {"concept-id": self.collections[i]['id']},
+                                                    "umm": {key: value for key, value in self.records[i].items() if key != 'ConceptId'}}
+                                                   for i in page]}
+        return {"feed": {"entry": [self.collections[i] for i in page]}}
+
+    # the short names a CMR collections url would return, in order
+    def top_datasets(self, url):
+        return [entry['short_name'] for entry in self.search(url)['feed']['entry']]
+
+    # Same as CMRCache.get: the body of the response for the url. Every query is answered from the index
+    def get(self, url):
+        self.hits += 1
+        return json.dumps(self.search(url))
+
+    # responses from the real api aren't stored
+    def set(self, url, body):
+        pass
+
+
+# Build the index from the collection metadata files and time the queries get_top_cmr_dataset would make
+if __name__ == '__main__':
+    from CMR_Queries.cmr_query_utilities import build_cmr_query
+
+    dataset_directory = 'C:/Users/edwar/Desktop/Publishing Internship/datasets/'  # one UMM-C json file per GES DISC collection
+    start = time.perf_counter()
+    local_cmr = LocalCMR.from_directory(dataset_directory)
+    print(f'Indexed {len(local_cmr.collections)} collections in {time.perf_counter() - start:.2f}s')
+
+    queries = [build_cmr_query(platform, instrument, species, science_keyword_search, 20, level)[0]
+               for platform, instrument, species, level in [('aura', 'mls', 'ozone', None), ('aura', 'omi', 'no2', 'level 3'),
+                                                            ('terra', 'modis', 'aerosol', None), (None, 'airs', 'water vapor', 'level 2')]
+               for science_keyword_search in [True, False]]
+    for url in queries:
+        print(local_cmr.top_datasets(url)[:5], url)
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        for url in queries:
+            local_cmr.top_datasets(url)
+    print(f'{(time.perf_counter() - start) / (1000 * len(queries)) * 1e6:.1f}µs per query')
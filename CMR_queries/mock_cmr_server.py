@@ -0,0 +1,99 @@
+"""
+    A small local stand-in for the CMR collections search api. It is not part of the pipeline. It is used to benchmark
+    and test the CMR query code without hitting the live api (see cmr_async_utility.py). By default it answers with made
+    up datasets. Given a LocalCMR (local_cmr_utility.py) it answers with the real GES DISC collections instead, and given
+    a CMRCassette (cmr_cassette_utility.py) it replays the recorded responses with the cassette's latency
+
+    Point the queries at it by setting cmr_query_utilities.CMR_COLLECTIONS_URL to the url returned by start_mock_cmr_server
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+
+# latency: seconds to wait before answering each request (to simulate the network)
+# error_rate: fraction of requests answered with a 429 or 503 so that retry logic can be exercised
+# local_cmr: optional LocalCMR to answer the queries from
+# cassette: optional CMRCassette to replay. Its latency is used instead of latency, and requests it doesn't have get a 404
+def start_mock_cmr_server(latency=0.05, error_rate=0.0, host='127.0.0.1', port=0, local_cmr=None, cassette=None):
+    class MockCMRHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep connections alive like the real api
+
+        def setup(self):
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_GET(self):
+            with count_lock:  # the handlers run in their own threads
+                server.request_count += 1
+            time.sleep(cassette.delay(self.path) if cassette is not None else latency)
+
+            if error_rate and random.random() < error_rate:
+                self.send_response(random.choice([429, 503]))
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            query = sorted(parse_qsl(urlsplit(self.path).query, keep_blank_values=True))
+            if cassette is not None:
+                body = cassette.body(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+            else:
+                if local_cmr is not None:
+                    feed = local_cmr.search(self.path)
+                else:
+                    num_results = int(dict(query).get('page_size', '10'))
+                    seed = zlib.crc32(json.dumps(query).encode('utf-8'))  # same query -> same datasets, however it was encoded
+                    feed = {"feed": {"entry": [{  # about the size of a CMR entry, most of it the summary and the links
+                        "processing_level_id": str(i % 4),
+                        "version_id": "004",
+                        "dataset_id": f'Mock dataset {i} V004 (DS{seed % 997}_{i}) at GES DISC',
+                        "data_center": "GES_DISC",
+                        "short_name": f'DS{seed % 997}_{i}',
+                        "organizations": ["NASA/GSFC/SED/ESD/GCDC/GESDISC"],
+                        "title": f'Mock dataset {i}',
+                        "summary": f'Mock dataset {i} made up for query {seed}. ' * 40,
+                        "id": f'C{seed % 100000 + i}-GES_DISC',
+                        "platforms": ["Aura"],
+                        "links": [{"rel": "http://esipfed.org/ns/fedsearch/1.1/data#", "hreflang": "en-US",
+                                   "href": f'https://acdisc.gesdisc.eosdis.nasa.gov/data/DS{seed % 997}_{i}/{j}/'} for j in range(8)],
+                        "score": round(1 / (i + 1), 3),
+                    } for i in range(num_results)]}}
+                body = json.dumps(feed, indent=2 if ('pretty', 'true') in query else None)
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body.encode('utf-8'))))
+            self.end_headers()
+            self.wfile.write(body.encode('utf-8'))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MockCMRHandler)
+    server.daemon_threads = True
+    server.request_count = 0
+    count_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/search/collections.json'
+
+
+if __name__ == '__main__':
+    mock_server, url = start_mock_cmr_server()
+    print("Mock CMR running at", url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mock_server.shutdown()
@@ -3,32 +3,16 @@ Similar to code in sentence_label_utilities.py. This file is not part of the pip
 the cmr queries if you have already extracted the sentence features.
 """
 
-from enum import Enum
 import json
 from collections import defaultdict
 from CMR_Queries.cmr_query_utilities import get_top_cmr_dataset
-
-
-class QueryMode(Enum):
-    ALL = 0,  # all combinations of missions/instruments and science keywords
-    RESTRICTED = 1  # only mission/instruments in the same sentence
-
-
-# split something like aura/mls----level 3 into platform/ins: aura/mls and level: level 3
-def get_platform_instrument_level(vc):
-    platform_instrument = vc.split('----')
-    if len(platform_instrument) > 1:
-        level = platform_instrument[1]
-        platform_instrument = platform_instrument[0]
-    else:
-        platform_instrument = platform_instrument[0]
-        level = None
-
-    return platform_instrument, level
+from CMR_Queries.cmr_cache_utility import CMRCache
+from CMR_Queries.cmr_query_planner_utility import QueryMode, get_platform_instrument_level, plan_paper_CMR_queries, \
+    run_planned_CMR_queries
 
 
 # build the cmr query and call get_top_cmr_dataset to actually run the query
-def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, sort_by_usage=False):
+def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, sort_by_usage=False, cache=None):
     platform_instrument_split = platform_instrument.split('/')
     platform, instrument = platform_instrument_split[0], platform_instrument_split[1]
 
@@ -36,10 +20,10 @@ def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, s
         platform = None
 
     query_str, cmr_dataset, url = get_top_cmr_dataset(platform, instrument, species,
-                                                      num_results=20, level=level, sort_by_usage=sort_by_usage)
+                                                      num_results=20, level=level, sort_by_usage=sort_by_usage, cache=cache)
     _, cmr_dataset_false, url_false = get_top_cmr_dataset(platform, instrument,
                                                           species, science_keyword_search=False,
-                                                          num_results=20, level=level, sort_by_usage=sort_by_usage)
+                                                          num_results=20, level=level, sort_by_usage=sort_by_usage, cache=cache)
     # cmr_couples_results[query_str] = {
     #     "dataset": cmr_dataset,
     #     "query": url
@@ -56,9 +40,12 @@ def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, s
     }
 
 
-# Given an initial features dictionary, rerun the cmr queries without having to refind the features
-def update_cmr_values(features, query_mode, sort_by_usage):
+# Given an initial features dictionary, rerun the cmr queries without having to refind the features. Pass in a CMRCache
+# to reuse the responses from previous runs. plan_queries collects the queries for all the papers first and runs each
+# unique query only once
+def update_cmr_values(features, query_mode, sort_by_usage, cache=None, plan_queries=False):
     paper_to_results = {}
+    paper_to_plan = {}
     count = 0
 
     for paper, feature in features.items():
@@ -89,43 +76,14 @@ def update_cmr_values(features, query_mode, sort_by_usage):
         # compute the CMR Queries
         cmr_couples_results = {}
         cmr_singles_results = {}
+        cmr_results = {"pairs": cmr_couples_results, "singles": cmr_singles_results}
 
-        # Restricted
-        if query_mode == QueryMode.RESTRICTED:
-            for couple, dict_counts in couples_to_species.items():
-                platform_instrument, level = get_platform_instrument_level(couple)
-                for species, species_count in dict_counts.items():
-                    if species_count <= 1:
-                        continue
-                    run_CMR_query(platform_instrument, species, level, cmr_couples_results, sort_by_usage)
-
-            instruments_in_pairs = [couple.split('/')[1] for couple in couples_to_species]
-            for instrument, dict_counts in instrument_to_species.items():
-                platform, level = None, None
-                # if instrument not in instruments_in_pairs:
-                for species, species_count in dict_counts.items():
-                    if species_count <= 1:
-                        continue
-                    run_CMR_query(f'{platform}/{instrument}', species, level, cmr_singles_results, sort_by_usage)
-
-
-        # Non-Restricted
-        elif query_mode == QueryMode.ALL:
-            for vc in summary_stats['valid_couples']:
-                platform_instrument, level = get_platform_instrument_level(vc)
-                for science_keyword in summary_stats['species']:
-                    if summary_stats['species'][science_keyword] <= 1:
-                        continue
-                    run_CMR_query(platform_instrument, science_keyword, level, cmr_couples_results, sort_by_usage)
-
-            instruments_in_pairs = [vc.split('/')[1] for vc in summary_stats['valid_couples']]
-            platform, level = None, None
-            for instrument in summary_stats['single_instrument']:
-                if instrument not in instruments_in_pairs:
-                    for science_keyword in summary_stats['species']:
-                        if summary_stats['species'][science_keyword] <= 1:
-                            continue
-                        run_CMR_query(f'{platform}/{instrument}', science_keyword, level, cmr_singles_results, sort_by_usage)
+        cmr_plan = plan_paper_CMR_queries(summary_stats, couples_to_species, instrument_to_species, query_mode)
+        if plan_queries:
+            paper_to_plan[paper] = cmr_plan  # run later, together with the queries for all the other papers
+        else:
+            for results_key, platform_instrument, species, level in cmr_plan:
+                run_CMR_query(platform_instrument, species, level, cmr_results[results_key], sort_by_usage, cache)
 
         # store the results
         paper_to_results[paper] = {
@@ -143,6 +101,10 @@ def update_cmr_values(features, query_mode, sort_by_usage):
         # print(couples_to_species)
         # print(instrument_to_species)
 
+    if plan_queries:
+        paper_to_cmr_results = {paper: paper_to_results[paper]['cmr_results'] for paper in paper_to_plan}
+        run_planned_CMR_queries(paper_to_plan, paper_to_cmr_results, run_CMR_query, sort_by_usage, cache)
+
     return paper_to_results
 
 
@@ -151,7 +113,8 @@ if __name__ == '__main__':
         features = json.load(f)
 
     sort_by_usages = True
-    results = update_cmr_values(features, QueryMode.ALL, sort_by_usages)
+    cache = CMRCache('cmr_cache.sqlite', ttl=None, offline=False)  # set offline=True to only use stored responses
+    results = update_cmr_values(features, QueryMode.ALL, sort_by_usages, cache, plan_queries=True)
 
     filename = "cmr_results/aura-omi/11-14-46omi_rerun_by_usage_features.json"
     with open(filename, 'w', encoding='utf-8') as f:
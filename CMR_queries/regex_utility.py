@@ -0,0 +1,33 @@
+"""
+    Small regex helpers shared by the keyword matching (keyword_matcher_utility.py, author_spatial_labeling_utility.py,
+    term_index_utility.py) and the ML keyword sentence builders (ML/keyword_substitution_utility.py). It doesn't import
+    anything from the rest of CMR_queries, so the ML code can use it without pulling in the labelling
+"""
+
+import re
+
+ASCII_LETTERS = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+REGEX_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+# Regex that matches any of the names literally, written as a trie (ie: 'aura', 'aqua' -> 'a(?:ura|qua)') so the regex
+# engine doesn't try every name one after the other. regexes are added as extra alternatives as they are
+def trie_pattern(names, regexes=()):
+    trie = {}
+    for name in names:
+        node = trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def node_pattern(node):
+        branches = [re.escape(char) + node_pattern(child) for char, child in sorted(node.items()) if char != '']
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:  # a name can end here
+            pattern = '(?:' + pattern + ')?'
+        return pattern
+
+    alternatives = ([node_pattern(trie)] if trie else []) + list(regexes)
+    return '(?:' + '|'.join(alternatives) + ')' if alternatives else '(?!)'
@@ -0,0 +1,89 @@
+'''
+    After a few entries are added to (or changed in) the keywords file, only the papers that contain those keywords need
+    their features extracted again. This compares the old and new keyword files, looks the changed terms up in the term
+    index saved next to the features (see term_index_utility.py), re-labels just the affected papers and merges them back
+    into the features file.
+
+    Terms that aren't in the index yet (ie: brand new keywords) are looked for directly in the text of the papers
+'''
+
+from CMR_Queries.sentence_label_utilities import run_keyword_sentences, get_text, basic_clean
+from CMR_Queries.term_index_utility import diff_keyword_terms, load_term_index, save_term_index, text_contains_term
+import glob
+import json
+import re
+
+
+# Returns the papers that have to be labelled again, and term -> papers for the changed terms that had to be looked for
+# in the text because they weren't in the index
+def find_affected_papers(term_index, changed_terms, papers, preprocessed_directory):
+    affected_papers = set(papers) - set(term_index['papers'])  # papers that were never indexed
+    unindexed_terms = []
+    for term in changed_terms:
+        if term in term_index['terms']:
+            affected_papers.update(term_index['terms'][term])
+        else:
+            unindexed_terms.append(term)
+
+    scanned_terms = {term: [] for term in unindexed_terms}
+    if unindexed_terms:
+        for paper in papers:
+            lowercase_text = (" " + basic_clean(get_text(paper, preprocessed_directory)) + " ").lower()
+            for term in unindexed_terms:
+                if text_contains_term(lowercase_text, term):
+                    scanned_terms[term].append(paper)
+                    affected_papers.add(paper)
+
+    return affected_papers.intersection(papers), scanned_terms
+
+
+def relabel_keyword_changes(old_keyword_file_location, keyword_file_location, mission_instrument_couples,
+                            preprocessed_directory, features_location, update_CMR=False, **label_options):
+    with open(old_keyword_file_location, encoding='utf-8') as f:
+        old_keywords = json.load(f)
+    with open(keyword_file_location, encoding='utf-8') as f:
+        new_keywords = json.load(f)
+    with open(features_location, encoding='utf-8') as f:
+        features = json.load(f)
+
+    term_index_location = features_location.replace('.json', '_term_index.json')
+    term_index = load_term_index(term_index_location)
+    papers = [re.split(r'[\\/]', paper)[-1].split('.')[0] for paper in glob.glob(preprocessed_directory + "*.txt")]
+
+    changed_terms, other_sections_changed = diff_keyword_terms(old_keywords, new_keywords)
+    print(f'{len(changed_terms)} keyword terms changed:', sorted(changed_terms))
+    if other_sections_changed:
+        print('Keywords other than mission/instrument/model/variable names changed, so every paper is affected')
+        affected_papers, scanned_terms = set(papers), {}
+    else:
+        affected_papers, scanned_terms = find_affected_papers(term_index, changed_terms, papers, preprocessed_directory)
+
+    # the new terms were just looked for in every paper, so they can go straight into the index
+    indexed_papers = set(term_index['papers'])
+    for term, term_papers in scanned_terms.items():
+        if indexed_papers.issubset(papers):
+            term_index['terms'][term] = sorted(indexed_papers.intersection(term_papers))
+    save_term_index(term_index_location, term_index)
+
+    print(f'Re-labelling {len(affected_papers)} of {len(papers)} papers')
+    new_features = run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_directory,
+                                         update_CMR=update_CMR, paper_subset=affected_papers,
+                                         term_index_location=term_index_location, **label_options)
+
+    features.update(new_features)
+    with open(features_location, 'w', encoding='utf-8') as f:
+        json.dump(features, f, indent=4)
+
+    return new_features
+
+
+if __name__ == '__main__':
+    # User parameters
+    old_keyword_file_location = '../data/json/keywords_backup.json'  # the keywords file the features were made with
+    keyword_file_location = '../data/json/keywords.json'
+    mission_instrument_couples = '../data/json/mission_instrument_couples_LOWER.json'
+    preprocessed_location = '../convert_using_cermzones/aura-omi/preprocessed/'
+    features_dict_location = '../CMR_Queries/cmr_results/aura-omi/3-22-15-Aura_omi_features.json'
+
+    relabel_keyword_changes(old_keyword_file_location, keyword_file_location, mission_instrument_couples,
+                            preprocessed_location, features_dict_location, update_CMR=False, checkpoint_location=None)
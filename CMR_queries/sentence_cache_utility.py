@@ -0,0 +1,228 @@
+"""
+    Bounded LRU cache in front of the per-sentence labelling (substitute_keywords in sentence_label_utilities.py). Many
+    papers share near-identical sentences (acknowledgments thanking the MLS team, the GES DISC data access statement,
+    repeated figure captions), so each of these only has to be labelled once in a run.
+
+    The LRU lives in one process. Behind it is an optional sqlite store (location) that every process using the cache
+    reads and writes, the same way the CMR responses are shared in cmr_cache_utility.py. With workers > 1
+    (run_keyword_sentences, stream_keyword_sentences) the cache is shared for the run (share): a sentence one worker
+    labelled is a hit in every other worker, and once the run is over its entries are back in the cache that was passed
+    in (unshare). Without a location the store is a temporary file that is removed by unshare. With a location the store
+    is kept, so the next run (or another machine reading the same file) starts warm. It keeps every sentence it is given,
+    max_size only bounds the LRU
+
+    The features are built from the labels' sets (found missions, instruments, ...) in the order they iterate in, and a
+    set rebuilt from the store can iterate in another order than the one that was labelled. So the store keeps that
+    order, and labels whose sets don't come back in it are labelled again (a miss) instead of being used
+
+    Entries are keyed by a hash of the cleaned sentence. The labels depend on the keywords file, so the cache is emptied
+    whenever it is used with a different keywords file (use_keywords)
+"""
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+from copy import copy
+
+
+class SentenceLabelCache:
+    # max_size: number of sentences to keep in memory. The least recently used sentence is dropped first
+    # location: optional sqlite file the labels are shared through (between processes and between runs)
+    def __init__(self, max_size=50000, location=None):
+        self.max_size = max_size
+        self.location = location
+        self.keywords_hash = None
+        self.entries = OrderedDict()  # sentence hash -> labels, least recently used first
+        self.hits, self.misses = 0, 0
+        self._temporary = False  # the store is a temporary file made by share
+        self._connection = None
+        self._pid = None
+
+    # sqlite connections can't be shared between processes, so each process (ie: each labelling worker) opens its own.
+    # A lost update only means a sentence is labelled twice, so the store doesn't wait for the disk on every write
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.location, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=OFF')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS labels '
+                                     '(keywords_hash TEXT NOT NULL, sentence BLOB NOT NULL, labels BLOB NOT NULL, '
+                                     'PRIMARY KEY (keywords_hash, sentence))')
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    # with a store every entry is in it, so the copy sent to a worker process doesn't need the entries in memory
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'], state['_pid'] = None, None
+        if self.location:
+            state['entries'] = OrderedDict()
+        return state
+
+    @staticmethod
+    def key(sentence):
+        return hashlib.blake2b(sentence.encode('utf-8'), digest_size=16).digest()
+
+    # keywords_hash: hash of the keywords file (ie: incremental_utility.hash_file). Empties the cache if it changed
+    def use_keywords(self, keywords_hash):
+        if keywords_hash != self.keywords_hash:
+            self.entries.clear()
+            self.keywords_hash = keywords_hash
+        if self.location:
+            self.connection.execute('DELETE FROM labels WHERE keywords_hash != ?', (keywords_hash,))
+            self.connection.commit()
+
+    # Lists in the labels are copied since they end up in the features, so the cached labels are never changed
+    @staticmethod
+    def copy_labels(labels):
+        return tuple(copy(value) if isinstance(value, list) else value for value in labels)
+
+    def _remember(self, key, labels):
+        self.entries[key] = labels
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    # The labels as they are kept in the store: the sets become lists in the order they iterate in
+    @staticmethod
+    def pack_labels(labels):
+        set_positions = [position for position, value in enumerate(labels) if isinstance(value, set)]
+        values = [list(value) if isinstance(value, set) else value for value in labels]
+        return pickle.dumps((set_positions, values), pickle.HIGHEST_PROTOCOL)
+
+    # The labels from the store, or None if one of the sets can't be rebuilt to iterate in the order it was stored in
+    @staticmethod
+    def unpack_labels(packed):
+        set_positions, values = pickle.loads(packed)
+        for position in set_positions:
+            order = values[position]
+            for insertion_order in (order, order[::-1]):
+                rebuilt = set(insertion_order)
+                if list(rebuilt) == order:
+                    values[position] = rebuilt
+                    break
+            else:
+                return None
+        return tuple(values)
+
+    # the labels in the store for the sentence hash, None if no process has labelled it yet (or they can't be unpacked)
+    def _get_shared(self, key):
+        row = self.connection.execute('SELECT labels FROM labels WHERE keywords_hash = ? AND sentence = ?',
+                                      (self.keywords_hash, key)).fetchone()
+        return self.unpack_labels(row[0]) if row else None
+
+    def _set_shared(self, key, labels):
+        self.connection.execute('INSERT OR IGNORE INTO labels (keywords_hash, sentence, labels) VALUES (?, ?, ?)',
+                                (self.keywords_hash, key, self.pack_labels(labels)))
+        self.connection.commit()
+
+    # The labels for the sentence: label_function(sentence, *args) the first time, the cached labels after that.
+    # The lists in what is returned are copies (copy_labels). The sets (found missions, instruments, ...) are shared with
+    # the cache and should only be read
+    def label(self, sentence, label_function, *args):
+        key = self.key(sentence)
+        labels = self.entries.get(key)
+        if labels is None and self.location:
+            labels = self._get_shared(key)
+            if labels is not None:
+                self._remember(key, labels)
+        if labels is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.copy_labels(labels)
+
+        self.misses += 1
+        labels = label_function(sentence, *args)
+        self._remember(key, labels)
+        if self.location:
+            self._set_shared(key, labels)
+        return self.copy_labels(labels)
+
+    # Share the cache with the worker processes it is sent to: without a location the entries in memory are written to a
+    # temporary store first
+    def share(self):
+        if self.location:
+            return
+        file_descriptor, self.location = tempfile.mkstemp(suffix='.sqlite')
+        os.close(file_descriptor)
+        self._temporary = True
+        self.connection.executemany('INSERT OR IGNORE INTO labels (keywords_hash, sentence, labels) VALUES (?, ?, ?)',
+                                    ((self.keywords_hash, key, self.pack_labels(labels)) for key, labels in self.entries.items()))
+        self.connection.commit()
+
+    # After the workers are done: the most recent entries of a temporary store are read back into memory (up to
+    # max_size) and the store is removed. A store with a location is left as it is
+    def unshare(self):
+        if not self._temporary:
+            return
+        rows = self.connection.execute('SELECT sentence, labels FROM labels WHERE keywords_hash = ? ORDER BY rowid DESC '
+                                       'LIMIT ?', (self.keywords_hash, self.max_size)).fetchall()
+        for key, packed in reversed(rows):
+            labels = self.unpack_labels(packed) if key not in self.entries else None
+            if labels is not None:
+                self._remember(key, labels)
+        self.close()
+        for location in (self.location, self.location + '-wal', self.location + '-shm'):
+            if os.path.exists(location):
+                os.remove(location)
+        self.location, self._temporary = None, False
+
+    # hits and misses from a copy of the cache (ie: the one in a worker process)
+    def add_counts(self, hits, misses):
+        self.hits += hits
+        self.misses += misses
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def clear(self):
+        self.entries.clear()
+        self.hits, self.misses = 0, 0
+        if self.location:
+            self.connection.execute('DELETE FROM labels')
+            self.connection.commit()
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+# Used by the check below: label the sentences of one paper in a worker process with its copy of the shared cache
+def _label_words(sentence):
+    return sentence.lower(), len(sentence.split()), [sentence]
+
+
+def _label_paper_with_cache(sentence_cache, sentences):
+    for sentence in sentences:
+        sentence_cache.label(sentence, _label_words)
+    return sentence_cache.hits, sentence_cache.misses
+
+
+if __name__ == '__main__':
+    # two worker processes, one after the other, label papers that share two sentences: the second paper gets its hits
+    # from the first worker's labels, and the cache that was passed in has every sentence once the run is over
+    first_paper = ['the MLS team is thanked', 'data were obtained from the GES DISC', 'ozone was low']
+    second_paper = ['the MLS team is thanked', 'data were obtained from the GES DISC', 'water vapor was high']
+    cache = SentenceLabelCache()
+    cache.use_keywords('keywords')
+    cache.share()
+    counts = []
+    for paper in (first_paper, second_paper):
+        with multiprocessing.Pool(1) as pool:
+            counts.append(pool.apply(_label_paper_with_cache, (cache, paper)))
+    cache.unshare()
+
+    print(f'First paper: {counts[0][0]} hits, {counts[0][1]} misses. Second paper: {counts[1][0]} hits, {counts[1][1]} misses. '
+          f'{len(cache.entries)} sentences back in the cache')
+    if counts != [(0, 3), (2, 1)] or len(cache.entries) != 4 or cache.location is not None:
+        sys.exit(1)
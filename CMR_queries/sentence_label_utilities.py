@@ -7,14 +7,18 @@ import re
 import itertools
 from collections import defaultdict
 from CMR_Queries.cmr_query_utilities import get_top_cmr_dataset
-from CMR_Queries.author_spatial_labeling_utility import label_author, identify_spatial_resolution
+from CMR_Queries.author_spatial_labeling_utility import label_author, get_default_resolution_extractor
+from CMR_Queries.keyword_matcher_utility import KeywordMatcher
+from CMR_Queries.couple_lookup_utility import CoupleLookup
+from CMR_Queries.text_clean_utility import get_default_normalizer
+from CMR_Queries.cmr_query_planner_utility import QueryMode, get_platform_instrument_level, plan_paper_CMR_queries, \
+    run_planned_CMR_queries
+from CMR_Queries.checkpoint_utility import load_checkpoint, open_checkpoint, append_checkpoint
+from CMR_Queries.incremental_utility import hash_file, hash_inputs, load_manifest, save_manifest, find_unchanged_papers
+from CMR_Queries.term_index_utility import keyword_terms, find_paper_terms, load_term_index, save_term_index, update_term_index
 import glob
-from enum import Enum
-
-
-class QueryMode(Enum):
-    ALL = 0,  # all combinations of missions/instruments and science keywords
-    RESTRICTED = 1  # only mission/instruments in the same sentence
+import sys
+import multiprocessing
 
 
 def get_text(paper, preprocessed_location, alt_path=''):
@@ -23,17 +27,9 @@ def get_text(paper, preprocessed_location, alt_path=''):
     return text
 
 
-# Clean the text up a little
+# Clean the text up a little. The clean up is compiled once in text_clean_utility.py
 def basic_clean(text):
-    text = re.sub(r'[^(?:\x00-\x7F)|\u25e6|\u00d7]+', '', text)  # remove non unicode characters but keep ◦ and ×
-    text = re.sub(r'et al\.,?', 'et al', text)
-    text = re.sub(r'e\.g\.,?', 'eg', text)
-    text = re.sub(r'i\.e\.,?', 'ie', text)
-    text = re.sub(r'\(\)', '', text)  # punctuation
-    text = re.sub(r'(https?://)?([\da-z\.-]+)\.([a-z\.]{2,6})([/\w \.-]*)', '', text)  # removing the links
-
-    text = re.sub('\n', ' ', text)
-    return text
+    return get_default_normalizer().clean(text)
 
 
 # Given a mission and instrument, determine if that mission/ins couple is possible (ie: Aura/MLS) or not possible
@@ -47,133 +43,47 @@ def is_valid_couple(mission, instrument, couples, debug=False):
     return result
 
 
-# Create a list of all the valid couples
+# Create a list of all the valid couples. all_possible_couples is a CoupleLookup, or the couples dictionary in which case
+# every mission/instrument pair is checked with is_valid_couple
 def find_valid_couples(missions, instruments, all_possible_couples, levels=[]):
-    valid_couples = set()
     single_mission, single_instrument = set(missions), set(instruments)
 
     level_modifier = ''
     if len(levels) == 1:
         level_modifier = f'----{levels[0]}'
 
-    for perm in itertools.product(*[missions, instruments]):
-        if is_valid_couple(perm[0], perm[1], couples=all_possible_couples):
-            valid_couples.add(f'{perm[0]}/{perm[1]}{level_modifier}')
+    if isinstance(all_possible_couples, CoupleLookup):
+        couples = all_possible_couples.valid_couples(missions, instruments)
+    else:
+        couples = [perm for perm in itertools.product(*[missions, instruments]) if is_valid_couple(perm[0], perm[1], couples=all_possible_couples)]
+    valid_couples = {f'{mission}/{instrument}{level_modifier}' for mission, instrument in couples}
 
     return valid_couples, single_mission, single_instrument
 
 
-# in the text, convert all long long names to short names (ie 'microwave limb sounder' -> 'mls')
-def substitute_keywords(sentence, keywords):
-    keyword_count = 0  # count for how many keywords we find in total
-    # keep track of the missions, instrument, species, and models that we find
-    found_missions, found_instruments, found_species, found_models = set(), set(), set(), set()
-
-    sentence = " " + sentence + " "  # to make regex work at begging/end of lines
-
-    # Check for 'NO' (as in Nitrogen Oxide) before we lowercase the sentence which is different than the english word no
-    if len(re.findall(rf'[^a-zA-Z]NO[^a-zA-Z]', sentence)) > 0:
-        found_species.add('NO')
-
-    lowercase_sentence = sentence.lower()
-
-    # Declare the short and long names we are looking for
-    missions_long = list(keywords['missions']['long_to_short'])
-    models_long = list(keywords['models']['long_to_short'])
-    instruments_long = list(keywords['instruments']['long_to_short'])
-    variables_long = list(keywords['variables']['long_to_short'])
-
-    missions_short = list(keywords['missions']['short_to_long'])
-    models_short = list(keywords['models']['short_to_long'])
-    instruments_short = list(keywords['instruments']['short_to_long'])
-    variables_short = list(keywords['variables']['short_to_long'])
-
-    for short_m in missions_short:
-        if short_m == '':
-            continue
-        short_matches = re.findall(rf'[^a-zA-Z]{short_m}[^a-zA-Z\-]', lowercase_sentence)  # look for occurrences of the mission
-        if len(short_matches) > 0:
-            found_missions.add(short_m)  # keep track of the mission we find
-        keyword_count += len(short_matches)
-
-    for short_i in instruments_short:
-        if short_i == '' or short_i == 'not applicable':
-            continue
-        short_matches = re.findall(rf'[^a-zA-Z]{short_i}[^a-zA-Z\-]', lowercase_sentence)
-        if len(short_matches) > 0:
-            found_instruments.add(short_i)
-        keyword_count += len(short_matches)
-
-    for short_mod in models_short:
-        if short_mod == '':
-            continue
-        short_matches = re.findall(rf'[^a-zA-Z]{short_mod}[^a-zA-Z\-]', lowercase_sentence)
-        if len(short_matches) > 0:
-            found_models.add(short_mod)
-        keyword_count += len(short_matches)
+# in the text, convert all long long names to short names (ie 'microwave limb sounder' -> 'mls'). The keyword matching
+# itself is done by a KeywordMatcher. Build it once and pass it in when labelling many sentences
+def substitute_keywords(sentence, keywords, matcher=None):
+    if matcher is None:
+        matcher = KeywordMatcher(keywords)
 
-    for short_v in variables_short:
-        if short_v == '':
-            continue
-        short_matches = re.findall(rf'[^a-zA-Z]{short_v}[^a-zA-Z\-]', lowercase_sentence)
-        if len(short_matches) > 0:
-            found_species.add(short_v)
-
-    # Look for long names
-    for long_m in missions_long:
-        if long_m in lowercase_sentence and long_m != '':
-            short_m = keywords['missions']['long_to_short'][long_m]
-            lowercase_sentence = re.sub(rf'{long_m}', f'{short_m}', lowercase_sentence)  # replace long name with short name
-            keyword_count += 1
-            found_missions.add(short_m)  # keep track of the missions that were found
-
-    for long_i in instruments_long:
-        if long_i in lowercase_sentence and long_i != '':
-            short_i = keywords['instruments']['long_to_short'][long_i]
-            lowercase_sentence = re.sub(rf'{long_i}', f'{short_i}', lowercase_sentence)
-            keyword_count += 1
-            found_instruments.add(short_i)
-
-    for long_mod in models_long:
-        if long_mod in lowercase_sentence and long_mod != '':
-            short_mod = keywords['models']['long_to_short'][long_mod]
-            lowercase_sentence = re.sub(rf'{long_mod}', f'{short_mod}', lowercase_sentence)
-            keyword_count += 1
-            found_instruments.add(short_mod)
-
-    for long_v in variables_long:
-        if long_v in lowercase_sentence and long_v != '':
-            short_v = keywords['variables']['long_to_short'][long_v]
-            lowercase_sentence = re.sub(rf'{long_v}', f'{short_v}', lowercase_sentence)
-            found_species.add(short_v)
+    # keep track of the missions, instrument, species, and models that we find along with how many keywords in total
+    lowercase_sentence, keyword_count, found_missions, found_instruments, found_species, found_models = matcher.match(sentence)
 
     # simple regex pattern to look for version and levels
     versions = re.findall(r'[vV]ersion \d', lowercase_sentence)
     levels = re.findall(r'[lL]evel[- ][0-4][a-z]?', lowercase_sentence)
 
-    authors = label_author(lowercase_sentence, keywords)
-    resolutions = []
-    if keyword_count >= 1:
-        resolutions = identify_spatial_resolution(lowercase_sentence)
-
-    return lowercase_sentence, keyword_count, found_missions, found_instruments, found_species if keyword_count >= 1 else [], versions, levels, found_models, authors, resolutions
+    authors = label_author(lowercase_sentence, keywords, matcher.author_index)
+    resolutions, resolution_values = [], []
+    if keyword_count >= 1:  # resolution_values: the resolutions converted to numbers in km or degrees
+        resolutions, resolution_values = get_default_resolution_extractor().extract(lowercase_sentence)
 
-
-# split something like aura/mls----level 3 into platform/ins: aura/mls and level: level 3
-def get_platform_instrument_level(vc):
-    platform_instrument = vc.split('----')
-    if len(platform_instrument) > 1:
-        level = platform_instrument[1]
-        platform_instrument = platform_instrument[0]
-    else:
-        platform_instrument = platform_instrument[0]
-        level = None
-
-    return platform_instrument, level
+    return lowercase_sentence, keyword_count, found_missions, found_instruments, found_species if keyword_count >= 1 else [], versions, levels, found_models, authors, resolutions, resolution_values
 
 
 # code to launch a CMR query
-def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, sort_by_usage=False):
+def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, sort_by_usage=False, cache=None):
     platform_instrument_split = platform_instrument.split('/')
     platform, instrument = platform_instrument_split[0], platform_instrument_split[1]
 
@@ -181,10 +91,10 @@ def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, s
         platform = None
 
     query_str, cmr_dataset, url = get_top_cmr_dataset(platform, instrument, species,
-                                                      num_results=20, level=level, sort_by_usage=False)
+                                                      num_results=20, level=level, sort_by_usage=False, cache=cache)
     _, cmr_dataset_false, url_false = get_top_cmr_dataset(platform, instrument,
                                                           species, science_keyword_search=False,
-                                                          num_results=20, level=level, sort_by_usage=False)
+                                                          num_results=20, level=level, sort_by_usage=False, cache=cache)
     # cmr_couples_results[query_str] = {
     #     "dataset": cmr_dataset,
     #     "query": url
@@ -201,158 +111,408 @@ def run_CMR_query(platform_instrument, species, level, cmr_results_dictionary, s
     }
 
 
-# Main function. Loop through all the papers finding the keywords, querying CMR, and storing the results
-def run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_directory, alt_path='',
-                          query_mode=QueryMode.ALL, sort_by_usage=False, single_paper=None, update_CMR=True):
-    # single paper will be the pdf key of a specific paper if we just want to run the labelling on that specific paper
+# The features of a paper before any sentence is added: summary stats (how many sentences each valid couple, model,
+# mission... appeared in), the couples/instruments to species counts and the labelled sentences
+def new_paper_features():
+    summary_stats = {
+        "valid_couples": defaultdict(int),
+        "single_mission": defaultdict(int),
+        "models": defaultdict(int),
+        "single_instrument": defaultdict(int),
+        "species": defaultdict(int),
+    }
+    return summary_stats, defaultdict(dict), defaultdict(dict), []
+
+
+# Add one labelled sentence (the labels from substitute_keywords) to the features of its paper (new_paper_features)
+def add_sentence_features(features, labels, all_couples, query_mode=QueryMode.ALL):
+    summary_stats, couples_to_species, instrument_to_species, sentences_list = features
+    sent, keyword_count, found_missions, found_instruments, found_species, versions, levels, found_models, authors, resolutions, resolution_values = labels
+    valid_couples, single_mission, single_instrument = find_valid_couples(found_missions, found_instruments, all_couples, levels)
+
+    # **********************************
+    # update the couples and species dict
+    if query_mode == QueryMode.RESTRICTED:  # remember restricted requires the
+        for vc in valid_couples:
+            for species in found_species:
+                couples_to_species[vc][species] = couples_to_species[vc].get(species, 0) + 1
+
+        for i in single_instrument:
+            for species in found_species:
+                instrument_to_species[i][species] = instrument_to_species[i].get(species, 0) + 1
+    # ************************************
+
+    # Building up the summary stats based on number of sentences a couple/model/mission...etc appeared in
+    for vc in valid_couples:
+        summary_stats["valid_couples"][vc] += 1
+
+    for mod in found_models:
+        summary_stats['models'][mod] += 1
+
+    for m in single_mission:
+        summary_stats["single_mission"][m] += 1
+
+    for i in single_instrument:
+        summary_stats['single_instrument'][i] += 1
+
+    for s in found_species:
+        summary_stats['species'][s] += 1
+
+    # if the sentence contained at least once keyword, store the sentence and the labels for that sentence
+    if keyword_count >= 1:
+        s = {
+            "sentence": re.sub(r' {2,}', ' ', sent).strip(),
+            "couples": list(valid_couples),
+            "missions": list(single_mission),
+            "instruments": list(single_instrument),
+            "models": list(found_models),
+            "species": list(found_species),
+            "version": versions,
+            "levels": levels,
+            "authors": authors,
+            "resolutions": resolutions,
+            "resolution_values": resolution_values,
+        }
+        sentences_list.append(s)
+
+
+# Find the keywords in every sentence of the (cleaned) text and build up the summary stats for the paper
+# whole_paper_scan: find the keywords for the whole paper at once and only label the sentences that have any. The
+# sentences without a mission/instrument/model name don't add anything to the results, so they are skipped
+# prefilter: only used without the whole paper scan. Skip the sentences the matcher's TokenPrefilter rules out before
+# labelling them. The sentences the whole paper scan picks all have a mission, instrument or model name, so they would all
+# pass it
+# sentence_cache: optional SentenceLabelCache so sentences that were already labelled (in this paper or another one) aren't
+# labelled again
+def extract_paper_features(text, keywords, matcher, all_couples, query_mode=QueryMode.ALL, whole_paper_scan=True,
+                           sentence_cache=None, prefilter=True):
+    features = new_paper_features()
+
+    sentences = re.split(r'(?<!\d)\.(?!\d)', text)  # split on '.' if '.' is not in a decimal
+    if whole_paper_scan:
+        sentence_indices = matcher.keyword_sentence_indices(sentences)
+    elif prefilter:
+        sentence_indices = [i for i, sentence in enumerate(sentences) if matcher.prefilter.could_match(sentence)]
+    else:
+        sentence_indices = range(len(sentences))
+    for sentence_index in sentence_indices:  # Basically for each sentence
+        original_sent = sentences[sentence_index]
+        if sentence_cache is not None:
+            labels = sentence_cache.label(original_sent, substitute_keywords, keywords, matcher)
+        else:
+            labels = substitute_keywords(original_sent, keywords, matcher)
+        add_sentence_features(features, labels, all_couples, query_mode)
+
+    return features
+
+
+# Launch the CMR queries for one paper based on the features that were extracted from it
+def run_paper_CMR_queries(summary_stats, couples_to_species, instrument_to_species, query_mode=QueryMode.ALL, sort_by_usage=False,
+                          cache=None):
+    # store the CMR Queries here
+    cmr_results = {"pairs": {}, "singles": {}}
+
+    for results_key, platform_instrument, species, level in plan_paper_CMR_queries(summary_stats, couples_to_species, instrument_to_species, query_mode):
+        run_CMR_query(platform_instrument, species, level, cmr_results[results_key], sort_by_usage, cache)
+
+    return cmr_results['pairs'], cmr_results['singles']
+
+
+# Label a single paper: extract the features from its sentences and (optionally) query CMR. Returns None if the text
+# file for the paper can't be found.
+# If a cmr_plan list is passed in, the queries the paper needs are added to it instead of being run, and the CMR results
+# are left empty to be filled in later by run_planned_CMR_queries
+# If a paper_terms set is passed in, the keyword terms found in the text are added to it (for the term index)
+def label_paper(paper, preprocessed_directory, keywords, matcher, all_couples, alt_path='', query_mode=QueryMode.ALL,
+                sort_by_usage=False, update_CMR=True, cache=None, cmr_plan=None, paper_terms=None, whole_paper_scan=True,
+                sentence_cache=None, prefilter=True):
+    try:
+        text = get_text(paper, preprocessed_directory, alt_path=alt_path)
+    except FileNotFoundError:
+        return None
+    text = basic_clean(text)
+
+    if paper_terms is not None:
+        paper_terms.update(find_paper_terms(text, matcher))
 
+    features = extract_paper_features(text, keywords, matcher, all_couples, query_mode, whole_paper_scan, sentence_cache, prefilter)
+    return build_paper_results(features, query_mode, sort_by_usage, update_CMR, cache, cmr_plan)
+
+
+# The results of a paper from its features (extract_paper_features): the summary stats, the CMR results and the sentences.
+# The CMR queries are run, added to cmr_plan, or not run at all (update_CMR=False) the same way as in label_paper
+def build_paper_results(features, query_mode=QueryMode.ALL, sort_by_usage=False, update_CMR=True, cache=None, cmr_plan=None):
+    summary_stats, couples_to_species, instrument_to_species, sentences_list = features
+
+    # Launching CMR queries
+    if update_CMR and cmr_plan is not None:
+        cmr_plan += plan_paper_CMR_queries(summary_stats, couples_to_species, instrument_to_species, query_mode)
+        cmr_couples_results, cmr_singles_results = {}, {}
+    elif update_CMR:
+        cmr_couples_results, cmr_singles_results = run_paper_CMR_queries(summary_stats, couples_to_species, instrument_to_species, query_mode, sort_by_usage, cache)
+    else:
+        cmr_couples_results = 'Not Run'
+        cmr_singles_results = 'Not Run'
+
+    return {
+        "summary_stats": summary_stats,
+        "cmr_results": {
+            "pairs": cmr_couples_results,
+            "singles": cmr_singles_results
+        },
+        "sentences": sentences_list
+    }
+
+
+# Each worker process in the pool loads the keywords and couples files (and compiles the matcher) once, then labels
+# whatever papers it is handed. The streaming pipeline (streaming_label_utility.py) uses the same workers
+label_worker_state = {}
+
+
+def init_label_worker(keyword_file_location, mission_instrument_couples, label_options, plan_queries=False, index_terms=False):
     with open(keyword_file_location) as f:
         keywords = json.load(f)
 
-    with open(mission_instrument_couples, encoding='utf-8') as f:
-        all_couples = json.load(f)
+    all_couples = CoupleLookup.from_files(mission_instrument_couples)
+
+    label_worker_state['label_options'] = dict(label_options, keywords=keywords, matcher=KeywordMatcher(keywords), all_couples=all_couples)
+    label_worker_state['plan_queries'] = plan_queries
+    label_worker_state['index_terms'] = index_terms
+
+
+# The counters of the worker's sentence cache and prefilter
+def label_worker_counts():
+    sentence_cache, prefilter = label_worker_state['label_options']['sentence_cache'], label_worker_state['label_options']['matcher'].prefilter
+    counts = {"prefilter_checked": prefilter.checked, "prefilter_rejected": prefilter.rejected}
+    if sentence_cache is not None:
+        counts.update(cache_hits=sentence_cache.hits, cache_misses=sentence_cache.misses)
+    return counts
+
+
+# label_function(*args, **kwargs) and how much each of the worker's counters (label_worker_counts) went up while it ran
+def count_label_worker(label_function, *args, **kwargs):
+    counts_before = label_worker_counts()
+    result = label_function(*args, **kwargs)
+    return result, {name: count - counts_before[name] for name, count in label_worker_counts().items()}
+
+
+# Add the counts of one paper to the counters of the run. The workers of a pool count the hits and misses of their own
+# copies of the sentence cache, so these are added to sentence_cache
+def add_label_counts(run_counts, counts, sentence_cache=None, in_pool=False):
+    for name, count in counts.items():
+        run_counts[name] += count
+    if in_pool and sentence_cache is not None and counts:
+        sentence_cache.add_counts(counts['cache_hits'], counts['cache_misses'])
+
+
+# What is printed and saved at the end of a run: the sentence cache and prefilter counts, and the term index
+# paper_to_terms: pdf_key -> the keyword terms in the paper, for the papers that were labelled
+def finish_label_run(run_counts, keyword_file_location, sentence_cache=None, term_index_location=None, paper_to_terms=None):
+    if sentence_cache is not None:
+        print(f'Sentence cache: {sentence_cache.hits} hits, {sentence_cache.misses} misses')
+    if run_counts['prefilter_checked']:
+        print(f"Prefilter: rejected {run_counts['prefilter_rejected']} of {run_counts['prefilter_checked']} sentences "
+              f"({run_counts['prefilter_rejected'] / run_counts['prefilter_checked']:.1%})")
+
+    if term_index_location:
+        with open(keyword_file_location, encoding='utf-8') as f:
+            all_terms = keyword_terms(json.load(f))
+        save_term_index(term_index_location, update_term_index(load_term_index(term_index_location), paper_to_terms or {}, all_terms))
+
+
+# The keyword terms of the papers that weren't labelled in this run (from the checkpoint, or unchanged in incremental
+# mode) and aren't in the term index yet. Without them the saved index would leave those papers out, and a keywords
+# change would never re-label them. Papers whose text can't be found are left out
+def find_skipped_paper_terms(skipped_papers, term_index_location, keyword_file_location, preprocessed_directory, alt_path=''):
+    indexed_papers = set(load_term_index(term_index_location)['papers'])
+    missing_papers = [paper for paper in skipped_papers if paper not in indexed_papers]
+    if not missing_papers:
+        return {}
+
+    with open(keyword_file_location) as f:
+        matcher = KeywordMatcher(json.load(f))
+    paper_to_terms = {}
+    for paper in missing_papers:
+        try:
+            text = get_text(paper, preprocessed_directory, alt_path=alt_path)
+        except FileNotFoundError:
+            continue
+        paper_to_terms[paper] = find_paper_terms(basic_clean(text), matcher)
+    print(f'Term index: added {len(paper_to_terms)} papers that were skipped in this run')
+    return paper_to_terms
+
+
+# pdf key -> (pdf key, results, CMR plan, keyword terms, counts). counts: see count_label_worker
+def _label_paper_in_worker(paper):
+    print(paper)
+    cmr_plan = [] if label_worker_state['plan_queries'] else None
+    paper_terms = set() if label_worker_state['index_terms'] else None
+    results, counts = count_label_worker(label_paper, paper, cmr_plan=cmr_plan, paper_terms=paper_terms,
+                                         **label_worker_state['label_options'])
+    return paper, results, cmr_plan, paper_terms, counts
+
+
+# Main function. Loop through all the papers finding the keywords, querying CMR, and storing the results
+def run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_directory, alt_path='',
+                          query_mode=QueryMode.ALL, sort_by_usage=False, single_paper=None, update_CMR=True, workers=1,
+                          cmr_cache=None, plan_queries=False, checkpoint_location=None, resume=False,
+                          manifest_location=None, previous_results=None, paper_subset=None, term_index_location=None,
+                          whole_paper_scan=True, sentence_cache=None, prefilter=True, overwrite_checkpoint=False):
+    # single paper will be the pdf key of a specific paper if we just want to run the labelling on that specific paper
+    # cmr_cache is an optional CMRCache so CMR queries that were already made are read from disk instead of the api
+    # (or a BulkCMRCache from cmr_bulk_utility.py to fetch each platform/instrument/level once and filter the science
+    # keywords locally, or a LocalCMR from local_cmr_utility.py to not use the api at all)
+    # workers > 1 shards the papers across that many processes. Results are still returned in the same order as the papers
+    # plan_queries: first extract the features for every paper, then run each unique CMR query once for the whole corpus
+    # checkpoint_location: every finished paper is appended to this JSONL file (None, the default, turns off checkpoints).
+    # resume=True skips the papers that are already in the checkpoint instead of starting over. A checkpoint that already
+    # has papers in it is only started over with overwrite_checkpoint=True, otherwise the run stops with a FileExistsError
+    # manifest_location: incremental mode. Only papers whose text, keywords/couples files or settings changed since the
+    # manifest was written are labelled, the others reuse their features from previous_results (a features dictionary)
+    # paper_subset: only label these pdf keys out of the directory
+    # term_index_location: keep the keyword term -> papers index (term_index_utility.py) in this file up to date. The
+    # papers that are skipped (resume, manifest_location) and aren't in the index yet are added to it too
+    # whole_paper_scan=False runs the keyword matching on every sentence instead of only the ones with keywords in them
+    # prefilter only applies to whole_paper_scan=False: with prefilter=True (the default) only the sentences that pass the
+    # token prefilter are labelled, and its rejection rate is printed. With the whole paper scan it does nothing (and
+    # nothing is printed), since the sentences the scan picks would all pass it
+    # sentence_cache: optional SentenceLabelCache (sentence_cache_utility.py). With workers > 1 it is shared between the
+    # workers for the run, so a sentence is labelled once for all of them and their entries end up in sentence_cache
 
     papers_not_found = []
     paper_to_results = {}
-    count = 0
+    paper_to_plan = {}
+    paper_to_terms = {}
+    run_counts = defaultdict(int)  # counters from labelling the papers (see label_worker_counts)
+    finished_papers = load_checkpoint(checkpoint_location) if checkpoint_location and resume else {}
 
     # we may be calling this from spot_update_features and just want to run this code for one single pdf
     if single_paper:
         pdf_dirs = [single_paper]
     else:
         pdf_dirs = glob.glob(preprocessed_directory + "*.txt")  # otherwise run for all files
-
-    for paper in pdf_dirs:
-        count += 1
-        paper = paper.split('\\')[-1].split('.')[0]  # just the pdf_key (ie: AI5SBBh6)
-        print(paper)
-
-        try:
-            text = get_text(paper, preprocessed_directory, alt_path=alt_path)
-        except FileNotFoundError:
-            papers_not_found.append(paper)
-            print("NOT FOUND")
-            continue
-        text = basic_clean(text)
-
-        # dictionary to store how many times we observed each valid couple, or how many we observed each model, ..etc
-        summary_stats = {
-            "valid_couples": defaultdict(int),
-            "single_mission": defaultdict(int),
-            "models": defaultdict(int),
-            "single_instrument": defaultdict(int),
-            "species": defaultdict(int),
-        }
-        couples_to_species = defaultdict(dict)
-        instrument_to_species = defaultdict(dict)
-
-        sentences_list = []
-        for original_sent in re.split(r'(?<!\d)\.(?!\d)', text):  # split on '.' if '.' is not in a decimal. Basically for each sentence
-            sent, keyword_count, found_missions, found_instruments, found_species, versions, levels, found_models, authors, resolutions = substitute_keywords(original_sent, keywords)
-            valid_couples, single_mission, single_instrument = find_valid_couples(found_missions, found_instruments, all_couples, levels)
-
-            # **********************************
-            # update the couples and species dict
-            if query_mode == QueryMode.RESTRICTED:  # remember restricted requires the
-                for vc in valid_couples:
-                    for species in found_species:
-                        couples_to_species[vc][species] = couples_to_species[vc].get(species, 0) + 1
-
-                for i in single_instrument:
-                    for species in found_species:
-                        instrument_to_species[i][species] = instrument_to_species[i].get(species, 0) + 1
-            # ************************************
-
-            # Building up the summary stats based on number of sentences a couple/model/mission...etc appeared in
-            for vc in valid_couples:
-                summary_stats["valid_couples"][vc] += 1
-
-            for mod in found_models:
-                summary_stats['models'][mod] += 1
-
-            for m in single_mission:
-                summary_stats["single_mission"][m] += 1
-
-            for i in single_instrument:
-                summary_stats['single_instrument'][i] += 1
-
-            for s in found_species:
-                summary_stats['species'][s] += 1
-
-            # if the sentence contained at least once keyword, store the sentence and the labels for that sentence
-            if keyword_count >= 1:
-                s = {
-                    "sentence": re.sub(r' {2,}', ' ', sent).strip(),
-                    "couples": list(valid_couples),
-                    "missions": list(single_mission),
-                    "instruments": list(single_instrument),
-                    "models": list(found_models),
-                    "species": list(found_species),
-                    "version": versions,
-                    "levels": levels,
-                    "authors": authors,
-                    "resolutions": resolutions,
-                }
-                sentences_list.append(s)
-
-        if update_CMR:
-            # store the CMR Queries here
-            cmr_couples_results = {}
-            cmr_singles_results = {}
-        else:
-            cmr_couples_results = 'Not Run'
-            cmr_singles_results = 'Not Run'
-
-        # Launching CMR queries
-        if update_CMR:
-            # Restricted - keywords must be in the same sentence
-            if query_mode == QueryMode.RESTRICTED:
-                for couple, dict_counts in couples_to_species.items():
-                    platform_instrument, level = get_platform_instrument_level(couple)
-                    for species, species_count in dict_counts.items():
-                        if species_count <= 1:
-                            continue
-                        run_CMR_query(platform_instrument, species, level, cmr_couples_results, sort_by_usage)
-
-                instruments_in_pairs = [couple.split('/')[1] for couple in couples_to_species]
-                for instrument, dict_counts in instrument_to_species.items():
-                    platform, level = None, None
-                    # if instrument not in instruments_in_pairs:
-                    for species, species_count in dict_counts.items():
-                        if species_count <= 1:
-                            continue
-                        run_CMR_query(f'{platform}/{instrument}', species, level, cmr_singles_results, sort_by_usage)
-
-            # Non-Restricted - any combinations of keywords accross the whole paper
-            elif query_mode == QueryMode.ALL:
-                for vc in summary_stats['valid_couples']:
-                    platform_instrument, level = get_platform_instrument_level(vc)
-                    for science_keyword in summary_stats['species']:
-                        if summary_stats['species'][science_keyword] <= 1:
-                            continue
-                        run_CMR_query(platform_instrument, science_keyword, level, cmr_couples_results, sort_by_usage)
-
-                instruments_in_pairs = [vc.split('/')[1] for vc in summary_stats['valid_couples']]
-                platform, level = None, None
-                for instrument in summary_stats['single_instrument']:
-                    if instrument not in instruments_in_pairs:
-                        for science_keyword in summary_stats['species']:
-                            if summary_stats['species'][science_keyword] <= 1:
-                                continue
-                            run_CMR_query(f'{platform}/{instrument}', science_keyword, level, cmr_singles_results, sort_by_usage)
-
-        paper_to_results[paper] = {
-            "summary_stats": summary_stats,
-            "cmr_results": {
-                "pairs": cmr_couples_results,
-                "singles": cmr_singles_results
-            },
-            "sentences": sentences_list
-        }
-        # Because this is a time consuming process, save a copy of the results every so often
-        if count % 100 == 0:
-            with open(f'partial_results_{count}.json', 'w', encoding='utf-8') as f:
-                json.dump(paper_to_results, f, indent=4)
+    papers = [re.split(r'[\\/]', paper)[-1].split('.')[0] for paper in pdf_dirs]  # just the pdf_key (ie: AI5SBBh6)
+    if paper_subset is not None:
+        paper_subset = set(paper_subset)
+        papers = [paper for paper in papers if paper in paper_subset]
+
+    if manifest_location:
+        inputs_hash = hash_inputs(keyword_file_location, mission_instrument_couples, query_mode=query_mode,
+                                  sort_by_usage=sort_by_usage, update_CMR=update_CMR)
+        unchanged_papers, text_hashes = find_unchanged_papers(papers, preprocessed_directory, load_manifest(manifest_location),
+                                                              inputs_hash, previous_results or {})
+        print(f'Incremental: {len(unchanged_papers)} of {len(papers)} papers are unchanged')
+        finished_papers.update(unchanged_papers)
+
+    papers_to_label = [paper for paper in papers if paper not in finished_papers]
+    if finished_papers:
+        print(f'Skipping {len(papers) - len(papers_to_label)} papers that are already done')
+
+    label_options = {
+        "preprocessed_directory": preprocessed_directory,
+        "alt_path": alt_path,
+        "query_mode": query_mode,
+        "sort_by_usage": sort_by_usage,
+        "update_CMR": update_CMR,
+        "cache": cmr_cache,
+        "whole_paper_scan": whole_paper_scan,
+        "sentence_cache": sentence_cache,
+        "prefilter": prefilter
+    }
+    if sentence_cache is not None:
+        sentence_cache.use_keywords(hash_file(keyword_file_location))  # a different keywords file empties the cache
+
+    # with plan_queries the CMR results are only filled in at the very end, so papers are checkpointed after that
+    checkpoint_each_paper = not (plan_queries and update_CMR)
+    checkpoint_file = open_checkpoint(checkpoint_location, resume, overwrite_checkpoint) if checkpoint_location else None
+
+    pool = None
+    if workers > 1 and len(papers_to_label) > 1:
+        if sentence_cache is not None:
+            sentence_cache.share()
+        pool = multiprocessing.Pool(workers, initializer=init_label_worker,
+                                    initargs=(keyword_file_location, mission_instrument_couples, label_options, plan_queries,
+                                              bool(term_index_location)))
+        labelled_papers = pool.imap(_label_paper_in_worker, papers_to_label)  # imap keeps the results in order
+    else:
+        init_label_worker(keyword_file_location, mission_instrument_couples, label_options, plan_queries, bool(term_index_location))
+        labelled_papers = map(_label_paper_in_worker, papers_to_label)
+
+    try:
+        for paper, results, cmr_plan, paper_terms, counts in labelled_papers:
+            add_label_counts(run_counts, counts, sentence_cache, in_pool=bool(pool))
+            if results is None:
+                papers_not_found.append(paper)
+                print("NOT FOUND")
+                continue
+
+            paper_to_results[paper] = results
+            if cmr_plan is not None:
+                paper_to_plan[paper] = cmr_plan
+            if paper_terms is not None:
+                paper_to_terms[paper] = paper_terms
+            # Because this is a time consuming process, save each paper as soon as it is done
+            if checkpoint_file and checkpoint_each_paper:
+                append_checkpoint(checkpoint_file, paper, results)
+
+        # second phase of plan_queries: run every unique query once and give each paper its results
+        if plan_queries and update_CMR:
+            paper_to_cmr_results = {paper: paper_to_results[paper]['cmr_results'] for paper in paper_to_plan}
+            run_planned_CMR_queries(paper_to_plan, paper_to_cmr_results, run_CMR_query, sort_by_usage, cmr_cache)
+            if checkpoint_file:
+                for paper, results in paper_to_results.items():
+                    append_checkpoint(checkpoint_file, paper, results)
+    finally:
+        if pool:
+            pool.terminate()
+            if sentence_cache is not None:
+                sentence_cache.unshare()
+        if checkpoint_file:
+            checkpoint_file.close()
+
+    # keep the papers in the same order whether or not they came from the checkpoint
+    paper_to_results = {paper: finished_papers.get(paper, paper_to_results.get(paper)) for paper in papers
+                        if paper in finished_papers or paper in paper_to_results}
+
+    if manifest_location:
+        manifest = load_manifest(manifest_location)
+        for paper in paper_to_results:
+            manifest[paper] = {"text_hash": text_hashes[paper], "inputs_hash": inputs_hash}
+        save_manifest(manifest_location, manifest)
+
+    if term_index_location:
+        skipped_papers = [paper for paper in paper_to_results if paper in finished_papers]
+        paper_to_terms.update(find_skipped_paper_terms(skipped_papers, term_index_location, keyword_file_location,
+                                                       preprocessed_directory, alt_path))
+    finish_label_run(run_counts, keyword_file_location, sentence_cache, term_index_location, paper_to_terms)
 
     return paper_to_results
 
+
+# check that the token prefilter is used (and rejects the sentences without a mission, instrument or model name) on the
+# per sentence path, without changing the features, and that the whole paper scan doesn't use it
+if __name__ == '__main__':
+    with open('../data/json/keywords.json') as f:
+        test_keywords = json.load(f)
+    test_couples = CoupleLookup.from_files('../data/json/mission_instrument_couples_LOWER.json')
+    test_text = basic_clean('Temperature and ozone from the Aura Microwave Limb Sounder (MLS) version 4 were used. The '
+                            'weather was nice today. We thank the reviewers for their comments. Water vapor is shown in '
+                            'figure 2. MLS level 2 data were obtained from the GES DISC.')
+
+    features = {}
+    for whole_paper_scan, prefilter in [(False, True), (False, False), (True, True)]:
+        test_matcher = KeywordMatcher(test_keywords)
+        features[whole_paper_scan, prefilter] = extract_paper_features(test_text, test_keywords, test_matcher, test_couples,
+                                                                        whole_paper_scan=whole_paper_scan, prefilter=prefilter)
+        print(f'whole_paper_scan={whole_paper_scan}, prefilter={prefilter}: the prefilter rejected '
+              f'{test_matcher.prefilter.rejected} of {test_matcher.prefilter.checked} sentences')
+        if whole_paper_scan and test_matcher.prefilter.checked > 0:
+            print('the whole paper scan used the prefilter')
+            sys.exit(1)
+        if not whole_paper_scan and prefilter and test_matcher.prefilter.rejected == 0:
+            print('the prefilter rejected nothing')
+            sys.exit(1)
+
+    if json.dumps(features[False, True], default=sorted) != json.dumps(features[False, False], default=sorted):
+        print('the prefilter changed the features')
+        sys.exit(1)
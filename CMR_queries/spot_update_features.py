@@ -22,7 +22,7 @@ if __name__ == '__main__':
 
     # re-extract the features for the specified pdf
     new_features = run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_location,
-                                         single_paper=pdf_to_update, update_CMR=False)
+                                         single_paper=pdf_to_update, update_CMR=False, checkpoint_location=None)
 
     print(new_features)
 
@@ -50,16 +50,18 @@ if __name__ == '__main__':
 
 
     '''
-        Code to update the feature extraction for all the papers in the directory
+        Code to update the feature extraction for all the papers in the directory. Uses a manifest next to the features
+        file so only the papers whose text or keyword/couples files changed since the last run are re-extracted
     '''
-    # all_features = {}
-    # for file in glob.glob(preprocessed_location + "*.txt"):
-    #     pdf_to_update = file.split('\\')[-1].replace('.txt', '')
-    #     new_features = run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_location,
-    #                                          single_paper=pdf_to_update, update_CMR=False)
-    #     all_features[pdf_to_update] = new_features[pdf_to_update]  # just the value
+    # with open(features_dict_location, encoding='utf-8') as f:
+    #     original_features = json.load(f)
+    #
+    # all_features = run_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_location,
+    #                                      update_CMR=False, checkpoint_location=None,
+    #                                      manifest_location=features_dict_location.replace('.json', '_manifest.json'),
+    #                                      previous_results=original_features)
     #
     # print(all_features)
     #
     # with open(features_dict_location.replace('.json', '_rerun_all.json'), 'w', encoding='utf-8') as f:
-    #     json.dump(all_features, f, indent=4)`
\ No newline at end of file
+    #     json.dump(all_features, f, indent=4)
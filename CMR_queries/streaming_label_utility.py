@@ -0,0 +1,211 @@
+"""
+    Streaming version of run_keyword_sentences (sentence_label_utilities.py) for labelling large collections on a small
+    machine. Every stage is a generator that hands things on one at a time:
+
+        iter_papers -> iter_sentences -> iter_labelled_sentences -> paper features -> write_results_jsonl
+
+    so only the paper that is being labelled (its text, its labelled sentences and its results) is in memory, instead of
+    the full sentence list of the paper and the results of the whole corpus. The results are written to a JSONL file (the
+    same format as the checkpoints in checkpoint_utility.py, one paper per line) as soon as each paper is done, and can be
+    read back one paper at a time with iter_checkpoint.
+
+    The features are the same as run_keyword_sentences with whole_paper_scan=False. The sentences are labelled one at a
+    time behind the token prefilter, since the whole paper scan needs all the sentences of a paper at once. CMR queries
+    are run per paper (plan_queries needs every paper's features before it can run anything)
+
+    The one thing that grows with the corpus is the term index: with term_index_location the keyword terms of every paper
+    are kept until the end of the run, since the index (a list of papers for each term) is rewritten in one go. That is
+    about as much memory as the index file itself
+"""
+
+import re
+import glob
+import multiprocessing
+from collections import defaultdict
+from CMR_Queries.sentence_label_utilities import QueryMode, get_text, basic_clean, substitute_keywords, new_paper_features, \
+    add_sentence_features, build_paper_results, label_worker_state, init_label_worker, count_label_worker, add_label_counts, \
+    find_skipped_paper_terms, finish_label_run
+from CMR_Queries.checkpoint_utility import iter_checkpoint, drop_incomplete_line, open_checkpoint, append_checkpoint
+from CMR_Queries.incremental_utility import hash_file
+from CMR_Queries.term_index_utility import find_paper_terms
+
+SENTENCE_END = re.compile(r'(?<!\d)\.(?!\d)')  # a '.' that is not in a decimal
+
+
+# The pdf keys (ie: AI5SBBh6) of the papers in the directory, read from the directory as they are needed
+# paper_subset: only these pdf keys. skip_papers: pdf keys to leave out (ie: the ones that are already done)
+def iter_paper_keys(preprocessed_directory, paper_subset=None, skip_papers=()):
+    if paper_subset is not None:
+        paper_subset = set(paper_subset)
+    for location in glob.iglob(preprocessed_directory + "*.txt"):
+        paper = re.split(r'[\\/]', location)[-1].split('.')[0]
+        if (paper_subset is None or paper in paper_subset) and paper not in skip_papers:
+            yield paper
+
+
+# (pdf key, cleaned text) for each paper. Only one paper's text is read at a time
+def iter_papers(preprocessed_directory, paper_subset=None, skip_papers=(), alt_path=''):
+    for paper in iter_paper_keys(preprocessed_directory, paper_subset, skip_papers):
+        try:
+            text = get_text(paper, preprocessed_directory, alt_path=alt_path)
+        except FileNotFoundError:
+            continue
+        yield paper, basic_clean(text)
+
+
+# The sentences of the (cleaned) text, split on '.' if '.' is not in a decimal. Same sentences as
+# re.split(r'(?<!\d)\.(?!\d)', text) without building the list
+def iter_sentences(text):
+    start = 0
+    for sentence_end in SENTENCE_END.finditer(text):
+        yield text[start:sentence_end.start()]
+        start = sentence_end.end()
+    yield text[start:]
+
+
+# The labels (substitute_keywords) of the sentences with at least one keyword in them. The others don't add anything to
+# the features of a paper. prefilter: skip the sentences the matcher's TokenPrefilter rules out before labelling them
+# sentence_cache: optional SentenceLabelCache
+def iter_labelled_sentences(sentences, keywords, matcher, sentence_cache=None, prefilter=True):
+    for sentence in sentences:
+        if prefilter and not matcher.prefilter.could_match(sentence):
+            continue
+        if sentence_cache is not None:
+            labels = sentence_cache.label(sentence, substitute_keywords, keywords, matcher)
+        else:
+            labels = substitute_keywords(sentence, keywords, matcher)
+        if labels[1] >= 1:  # keyword count
+            yield labels
+
+
+# Build up the features of one paper (as in extract_paper_features) from its labelled sentences
+def collect_paper_features(labelled_sentences, all_couples, query_mode=QueryMode.ALL):
+    features = new_paper_features()
+    for labels in labelled_sentences:
+        add_sentence_features(features, labels, all_couples, query_mode)
+    return features
+
+
+# Label one paper's cleaned text through the stages above. paper_terms: optional set the keyword terms of the text are
+# added to (for the term index)
+def label_text(text, keywords, matcher, all_couples, query_mode=QueryMode.ALL, sort_by_usage=False, update_CMR=True,
+               cache=None, sentence_cache=None, prefilter=True, paper_terms=None):
+    if paper_terms is not None:
+        paper_terms.update(find_paper_terms(text, matcher))
+    labelled_sentences = iter_labelled_sentences(iter_sentences(text), keywords, matcher, sentence_cache, prefilter)
+    features = collect_paper_features(labelled_sentences, all_couples, query_mode)
+    return build_paper_results(features, query_mode, sort_by_usage, update_CMR, cache)
+
+
+# the label options that only say where the papers are. Workers that are handed the text don't need them
+PAPER_LOCATION_OPTIONS = ('preprocessed_directory', 'alt_path')
+
+
+# (pdf key, cleaned text) -> (pdf key, results, paper terms, counts). The worker is set up by init_label_worker (the same
+# workers as run_keyword_sentences). counts: see count_label_worker
+def _label_text_in_worker(paper_text):
+    paper, text = paper_text
+    print(paper)
+    paper_terms = set() if label_worker_state['index_terms'] else None
+    label_options = {name: value for name, value in label_worker_state['label_options'].items() if name not in PAPER_LOCATION_OPTIONS}
+    results, counts = count_label_worker(label_text, text, paper_terms=paper_terms, **label_options)
+    return paper, results, paper_terms, counts
+
+
+# Same as _label_text_in_worker, but the worker reads the paper itself so only pdf keys are sent to the pool.
+# Papers that can't be read come back with results None
+def _label_paper_in_worker(paper):
+    try:
+        label_options = label_worker_state['label_options']
+        text = get_text(paper, label_options['preprocessed_directory'], alt_path=label_options['alt_path'])
+    except FileNotFoundError:
+        return paper, None, None, {}
+    return _label_text_in_worker((paper, basic_clean(text)))
+
+
+# The sink: write each labelled paper to the results JSONL file as soon as it comes in, nothing is kept in memory.
+# labelled_papers: (pdf key, results, ...) tuples. resume=True appends to the file instead of starting a new one, and a
+# file that already has papers in it is only started over with overwrite=True (see open_checkpoint).
+# Returns the number of papers written
+def write_results_jsonl(labelled_papers, results_location, resume=False, overwrite=False):
+    if resume:
+        drop_incomplete_line(results_location)
+    written = 0
+    with open_checkpoint(results_location, resume, overwrite) as results_file:
+        for paper, results, *_ in labelled_papers:
+            if results is None:
+                continue
+            append_checkpoint(results_file, paper, results)
+            written += 1
+    return written
+
+
+# Main function. Label every paper in the directory and stream the results to results_location (a JSONL file with one
+# {"pdf_key": ..., "results": {...}} line per paper). The options are the same as in run_keyword_sentences
+# resume=True skips the papers that are already in results_location and appends the rest to it. overwrite=True starts
+# results_location over if it already has papers in it (otherwise that stops the run with a FileExistsError)
+# workers > 1 shards the papers across that many processes. The papers are written in the order they were read. As in
+# run_keyword_sentences sentence_cache is shared between the workers for the run
+# term_index_location: as in run_keyword_sentences (the papers skipped by resume are added if they aren't in the index).
+# The terms of every paper are kept in memory until the index is saved
+def stream_keyword_sentences(keyword_file_location, mission_instrument_couples, preprocessed_directory, results_location,
+                             alt_path='', query_mode=QueryMode.ALL, sort_by_usage=False, update_CMR=True, workers=1,
+                             cmr_cache=None, resume=False, paper_subset=None, term_index_location=None, sentence_cache=None,
+                             prefilter=True, overwrite=False):
+    finished_papers = {paper for paper, _ in iter_checkpoint(results_location)} if resume else set()
+    if finished_papers:
+        print(f'Skipping {len(finished_papers)} papers that are already done')
+
+    label_options = {
+        "preprocessed_directory": preprocessed_directory,
+        "alt_path": alt_path,
+        "query_mode": query_mode,
+        "sort_by_usage": sort_by_usage,
+        "update_CMR": update_CMR,
+        "cache": cmr_cache,
+        "sentence_cache": sentence_cache,
+        "prefilter": prefilter
+    }
+    if sentence_cache is not None:
+        sentence_cache.use_keywords(hash_file(keyword_file_location))  # a different keywords file empties the cache
+
+    pool = None
+    paper_keys = iter_paper_keys(preprocessed_directory, paper_subset, finished_papers)
+    if workers > 1:
+        if sentence_cache is not None:
+            sentence_cache.share()
+        pool = multiprocessing.Pool(workers, initializer=init_label_worker,
+                                    initargs=(keyword_file_location, mission_instrument_couples, label_options, False,
+                                              bool(term_index_location)))
+        labelled_papers = pool.imap(_label_paper_in_worker, paper_keys)  # imap keeps the papers in order
+    else:
+        init_label_worker(keyword_file_location, mission_instrument_couples, label_options, False, bool(term_index_location))
+        labelled_papers = map(_label_text_in_worker, iter_papers(preprocessed_directory, paper_subset, finished_papers, alt_path))
+
+    paper_to_terms = {}  # only the keyword terms of each paper are kept, for the term index
+    run_counts = defaultdict(int)  # counters from labelling the papers (see label_worker_counts)
+
+    def track(labelled_papers):
+        for paper, results, paper_terms, counts in labelled_papers:
+            add_label_counts(run_counts, counts, sentence_cache, in_pool=bool(pool))
+            if results is None:
+                print("NOT FOUND")
+            elif paper_terms is not None:
+                paper_to_terms[paper] = paper_terms
+            yield paper, results
+
+    try:
+        written = write_results_jsonl(track(labelled_papers), results_location, resume, overwrite)
+    finally:
+        if pool:
+            pool.terminate()
+            if sentence_cache is not None:
+                sentence_cache.unshare()
+
+    print(f'Wrote {written} papers to {results_location}')
+    if term_index_location:
+        paper_to_terms.update(find_skipped_paper_terms(finished_papers, term_index_location, keyword_file_location,
+                                                       preprocessed_directory, alt_path))
+    finish_label_run(run_counts, keyword_file_location, sentence_cache, term_index_location, paper_to_terms)
+
+    return written
@@ -0,0 +1,94 @@
+"""
+    Inverted index from every keyword term (the short and long names in keywords.json) to the papers whose cleaned text
+    contains it. It is built while the features are extracted (run_keyword_sentences in sentence_label_utilities.py) and
+    saved next to the features file, so that when a few keywords change only the papers that contain them have to be
+    labelled again (see relabel_keyword_changes.py)
+
+    The index is stored as {"papers": [every pdf_key that was indexed], "terms": {term: [pdf_keys]}}. A term that is in
+    "terms" has been looked for in all of the indexed papers, so an empty list means no paper contains it
+"""
+
+import json
+import os
+import re
+from CMR_Queries.keyword_matcher_utility import CATEGORIES, is_variant_name, variant_pattern
+from CMR_Queries.regex_utility import REGEX_SPECIAL_CHARACTERS
+
+
+# All the terms KeywordMatcher looks for, in the same way it picks them out of the keywords file
+def keyword_terms(keywords):
+    terms = set()
+    for category in CATEGORIES:
+        for short_name in keywords[category]['short_to_long']:
+            if short_name == '' or (category == 'instruments' and short_name == 'not applicable'):
+                continue
+            terms.add(short_name)
+        terms.update(long_name for long_name in keywords[category]['long_to_short'] if long_name != '')
+    return terms
+
+
+# The terms in the matcher that show up anywhere in the (cleaned) text of a paper
+def find_paper_terms(text, matcher):
+    lowercase_text = (" " + text + " ").lower()
+    terms = {matcher.patterns[pattern_id] for pattern_id in matcher.scan(lowercase_text)}
+    terms.update(short_name for _, short_name, pattern in matcher.regex_short_names if pattern.search(lowercase_text))
+    terms.update(long_name for long_name, pattern in matcher.variant_patterns.items() if pattern.search(lowercase_text))
+    return terms
+
+
+# Same check as find_paper_terms, for a term that isn't in the matcher
+def text_contains_term(lowercase_text, term):
+    if is_variant_name(term):
+        return re.search(variant_pattern(term), lowercase_text) is not None
+    if REGEX_SPECIAL_CHARACTERS.intersection(term):
+        return re.search(rf'[^a-zA-Z]{term}[^a-zA-Z\-]', lowercase_text) is not None
+    return term in lowercase_text
+
+
+def load_term_index(term_index_location):
+    if not os.path.exists(term_index_location):
+        return {"papers": [], "terms": {}}
+    with open(term_index_location, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_term_index(term_index_location, term_index):
+    with open(term_index_location, 'w', encoding='utf-8') as f:
+        json.dump(term_index, f, indent=4)
+
+
+# Replace the postings of the papers that were just labelled. paper_to_terms: pdf_key -> terms found in that paper
+# New terms (ie: the keywords file gained some entries) are only added when every paper already in the index was
+# labelled again, otherwise the index couldn't tell which of the other papers contain them
+def update_term_index(term_index, paper_to_terms, all_terms):
+    indexed_papers = set(term_index['papers'])
+    term_to_papers = {term: set(papers) - set(paper_to_terms) for term, papers in term_index['terms'].items()}
+
+    if indexed_papers.issubset(paper_to_terms):
+        term_to_papers = {term: term_to_papers.get(term, set()) for term in all_terms}
+
+    for paper, terms in paper_to_terms.items():
+        for term in terms:
+            if term in term_to_papers:
+                term_to_papers[term].add(paper)
+
+    term_index['papers'] = sorted(indexed_papers.union(paper_to_terms))
+    term_index['terms'] = {term: sorted(papers) for term, papers in sorted(term_to_papers.items())}
+    return term_index
+
+
+# The terms that were added, removed or changed between two keyword files. If anything outside of the mission,
+# instrument, model and variable names changed (ie: author_last_names) every paper can be affected, and the second
+# return value is True
+def diff_keyword_terms(old_keywords, new_keywords):
+    changed_terms = set()
+    for category in CATEGORIES:
+        for names in ['short_to_long', 'long_to_short']:
+            old_names = old_keywords.get(category, {}).get(names, {})
+            new_names = new_keywords.get(category, {}).get(names, {})
+            changed_terms.update(name for name in old_names.keys() | new_names.keys()
+                                 if name != '' and old_names.get(name) != new_names.get(name))
+
+    other_sections_changed = any(old_keywords.get(section) != new_keywords.get(section)
+                                 for section in old_keywords.keys() | new_keywords.keys() if section not in CATEGORIES)
+    return changed_terms, other_sections_changed
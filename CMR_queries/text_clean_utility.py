@@ -0,0 +1,121 @@
+"""
+    The text clean up done on every preprocessed paper before it is labelled (basic_clean in sentence_label_utilities.py),
+    compiled once. The abbreviation and empty parenthesis rewrites are done in a single pass, and the links are removed
+    without the backtracking regex: the old pattern (https?://)?([\da-z\.-]+)\.([a-z\.]{2,6})([/\w \.-]*) retries every
+    position of every word, which was most of the time spent cleaning a paper. The cleaned text is exactly the same
+"""
+
+import re
+import sys
+import json
+import glob
+import os
+import time
+
+# characters that can be in the part of a link before the last '.' (the [\da-z\.-]+ of the old pattern)
+LINK_CHARACTERS = frozenset('0123456789abcdefghijklmnopqrstuvwxyz.-')
+LINK_DOTS = re.compile(r'\.(?=[a-z.]{2})')  # a link has a '.' followed by 2 of [a-z.], with a link character in front
+LINK_TAIL = re.compile(r'[/\w .-]*')
+REWRITES = {'et al.': 'et al', 'et al.,': 'et al', 'e.g.': 'eg', 'e.g.,': 'eg', 'i.e.': 'ie', 'i.e.,': 'ie', '()': ''}
+
+# excerpts of papers and what basic_clean (cmr_clean) and the ML basic_clean (ml_clean) turned them into before they were
+# compiled. Both cleaners are checked against it (ML/text_clean_utility.py checks the ML one)
+GOLDEN_LOCATION = '../data/json/text_clean_golden.json'
+
+
+# Same as re.sub(r'(https?://)?([\da-z\.-]+)\.([a-z\.]{2,6})([/\w \.-]*)', '', text). A link starts where its run of link
+# characters starts (or at the http(s):// right before it) and goes on as long as [/\w .-] does. The ML basic_clean
+# (ML/text_clean_utility.py) removes the links with this too
+def remove_links(text):
+    pieces, end = [], 0
+    for dot in LINK_DOTS.finditer(text):
+        if dot.start() - 1 < end or text[dot.start() - 1] not in LINK_CHARACTERS:  # (or already part of the previous link)
+            continue
+        start = dot.start() - 1
+        while start > end and text[start - 1] in LINK_CHARACTERS:
+            start -= 1
+        if start - 8 >= end and text.startswith('https://', start - 8):
+            link_start = start - 8
+        elif start - 7 >= end and text.startswith('http://', start - 7):
+            link_start = start - 7
+        else:
+            link_start = start
+        pieces.append(text[end:link_start])
+        end = LINK_TAIL.match(text, start).end()
+    pieces.append(text[end:])
+    return ''.join(pieces)
+
+
+class TextNormalizer:
+    def __init__(self):
+        self.non_ascii = re.compile(r'[^(?:\x00-\x7F)|\u25e6|\u00d7]+')  # remove non unicode characters but keep ◦ and ×
+        # the old passes went et al, e.g., i.e. then (). In 'i.e.g.' the e.g. was replaced first, so i.e. can't start there
+        self.rewrites = re.compile(r'et al\.,?|e\.g\.,?|i\.(?!e\.g\.)e\.,?|\(\)')
+
+    # Clean the text up a little
+    def clean(self, text):
+        text = self.non_ascii.sub('', text)
+        text = self.rewrites.sub(lambda match: REWRITES[match.group()], text)
+        text = remove_links(text)
+        return text.replace('\n', ' ')  # after the links, since a link can go over a space but not a new line
+
+
+_default_normalizer = TextNormalizer()
+
+
+def get_default_normalizer():
+    return _default_normalizer
+
+
+# the clean up one regex at a time, the way basic_clean used to do it
+def basic_clean_reference(text):
+    text = re.sub(r'[^(?:\x00-\x7F)|\u25e6|\u00d7]+', '', text)
+    text = re.sub(r'et al\.,?', 'et al', text)
+    text = re.sub(r'e\.g\.,?', 'eg', text)
+    text = re.sub(r'i\.e\.,?', 'ie', text)
+    text = re.sub(r'\(\)', '', text)
+    text = re.sub(r'(https?://)?([\da-z\.-]+)\.([a-z\.]{2,6})([/\w \.-]*)', '', text)
+    text = re.sub('\n', ' ', text)
+    return text
+
+
+# The names of the golden excerpts that clean doesn't turn into the stored cleaned text. key: 'cmr_clean' or 'ml_clean'
+def golden_differences(clean, key='cmr_clean', golden_location=GOLDEN_LOCATION):
+    with open(golden_location, encoding='utf-8') as f:
+        golden = json.load(f)
+    return [paper['name'] for paper in golden if clean(paper['text']) != paper[key]]
+
+
+# check the cleaned text against the golden excerpts and the old regex at a time clean up of every preprocessed paper (the
+# script fails if anything is cleaned differently), then benchmark on the largest preprocessed papers
+if __name__ == '__main__':
+    preprocessed_directory = '../convert_using_cermzones/preprocessed/'
+    paper_locations = sorted(glob.glob(preprocessed_directory + '*.txt'), key=os.path.getsize, reverse=True)
+
+    normalizer = get_default_normalizer()
+    golden_changed = golden_differences(normalizer.clean)
+    print(f'{len(golden_changed)} golden excerpts cleaned differently', golden_changed)
+
+    if not paper_locations:  # nothing was checked against the old clean up, which isn't a pass
+        print(f'No preprocessed papers in {preprocessed_directory}')
+        sys.exit(1)
+
+    changed = []
+    for location in paper_locations:
+        with open(location, encoding='utf-8') as f:
+            text = f.read()
+        if normalizer.clean(text) != basic_clean_reference(text):
+            changed.append(location)
+    print(f'{len(changed)} of {len(paper_locations)} papers cleaned differently', changed)
+    if golden_changed or changed:
+        sys.exit(1)
+
+    largest = []
+    for location in paper_locations[:20]:
+        with open(location, encoding='utf-8') as f:
+            largest.append(f.read())
+    for name, clean in [('one regex at a time', basic_clean_reference), ('TextNormalizer', normalizer.clean)]:
+        start = time.perf_counter()
+        for text in largest:
+            clean(text)
+        print(f'{name}: {(time.perf_counter() - start) / max(len(largest), 1) * 1000:.2f}ms per paper')
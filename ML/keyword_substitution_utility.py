@@ -0,0 +1,190 @@
+'''
+    The keyword substitution shared by the keyword sentence builders (keyword_sentences.py and the attempts in
+    z_keyword_sentence_improvement_attempts). The keywords are compiled once into a KeywordSubstitutionEngine: the long
+    names into regexes, the short names into one set. What each builder does with versions, levels and authors is
+    described by a SubstitutionPolicy.
+
+    Use get_engine(keywords, policy) so the engine is only built once for a keywords dictionary
+
+    Compared to the functions it replaced, on the sentences in ml_data (python keyword_substitution_utility.py times them):
+    remove_all_non_keywords is about 5x (keyword_sentences), 8x (with author) and 5x (must have version) faster, and
+    substitute_keywords about 2x, 4x and 2x. The whole builders gain less since they do more than the substitution. This
+    is short of the 10x that was asked for: the one search for any long name is about half of what is left
+'''
+
+import json
+import re
+import glob
+import time
+from CMR_queries.regex_utility import REGEX_SPECIAL_CHARACTERS, trie_pattern
+
+
+class SubstitutionPolicy:
+    # version_substitutions / level_substitutions: (regex, replacement) applied in order after the long names
+    # substitute_authors: replace full author names (keywords['author_names']) with the last name, and keep the last names
+    # keep_patterns: regexes for the words (other than keywords) that are kept in remove_all_non_keywords (ie: v4, L2)
+    # strip_characters: characters removed from each word before checking if it is a keyword
+    def __init__(self, version_substitutions=(), level_substitutions=(), substitute_authors=False, keep_patterns=(r'v\d',),
+                 strip_characters=''):
+        self.version_substitutions = list(version_substitutions)
+        self.level_substitutions = list(level_substitutions)
+        self.substitute_authors = substitute_authors
+        self.keep_patterns = list(keep_patterns)
+        self.strip_characters = strip_characters
+
+
+# keyword_sentences.py
+KEYWORD_SENTENCES_POLICY = SubstitutionPolicy(
+    version_substitutions=[(r'[vV]ersion ([0-9])', 'v\\1')],  # see if dataset versions are mentioned and replace 'version 4' with v4
+)
+
+# z_keyword_sentence_improvement_attempts/keyword_sentences_with_author.py
+AUTHOR_POLICY = SubstitutionPolicy(
+    version_substitutions=[(r'[vV]ersion ([0-9])(\.\d)?/?([vV]ersion)?(\d)?(\.?\d?)?', 'v\\1/v\\4'),
+                           (r'[vV]ersion ([0-9])', 'v\\1')],
+    level_substitutions=[(r'[lL]evel ?([0-9])', 'L\\1')],
+    substitute_authors=True,
+    keep_patterns=[r'v\d\.?\d?(/v\d)*', r'L\d'],
+    strip_characters='()-<>%=[]',  # strip the punctuation
+)
+
+# z_keyword_sentence_improvement_attempts/sentence_must_have_version.py
+VERSION_REQUIRED_POLICY = SubstitutionPolicy(
+    version_substitutions=[(r'[vV]ersion ([0-9])', 'v\\1')],
+    level_substitutions=[(r'[lL]evel ([0-9])', 'L\\1')],  # see if levels are mentioned
+)
+
+
+class KeywordSubstitutionEngine:
+    def __init__(self, keywords, policy=KEYWORD_SENTENCES_POLICY):
+        self.keywords = keywords
+        self.policy = policy
+
+        # (long name, compiled long name, short name), missions then instruments then variables
+        self.long_names = [(long_name, re.compile(rf'{long_name}'), short_name)
+                           for category in ['missions', 'instruments', 'variables']
+                           for long_name, short_name in keywords[category]['long_to_short'].items() if long_name != '']
+        # one search for all of the long names, most sentences don't have any so the loop over them can be skipped
+        self.any_long_name = re.compile(trie_pattern([long_name for long_name, _, _ in self.long_names])) if self.long_names else None
+
+        self.substitutions = [(re.compile(pattern), replacement)
+                              for pattern, replacement in policy.version_substitutions + policy.level_substitutions]
+
+        # (full name, compiled full name, last name). Names with regex characters are always substituted, the others only
+        # when they are in the sentence
+        self.authors = []
+        keep_words = set()
+        if policy.substitute_authors:
+            for author in keywords['author_names']:
+                author_last_name = author.split(' ')[-1]
+                self.authors.append((author, re.compile(rf'{author}'), author_last_name, bool(REGEX_SPECIAL_CHARACTERS.intersection(author))))
+                keep_words.add(author_last_name)
+        literal_authors = [author for author, _, _, always in self.authors if not always]
+        self.any_literal_author = re.compile(trie_pattern(literal_authors)) if literal_authors else None
+
+        for category in ['missions', 'instruments', 'variables']:
+            keep_words.update(keywords[category]['short_to_long'])
+        keep_words.discard('no')  # 'no' (nitrogen oxide) is never kept because it is too often just the english word
+        self.keep_words = frozenset(keep_words)
+        self.keep_pattern = re.compile('|'.join(f'(?:{pattern})' for pattern in policy.keep_patterns)) if policy.keep_patterns else None
+        self.strip_table = str.maketrans('', '', policy.strip_characters.replace(' ', ''))
+
+    # convert the long names to short names (ie 'microwave limb sounder' -> 'mls') and apply the policy's version, level
+    # and author substitutions
+    def substitute_keywords(self, sentence):
+        lowercase_sentence = sentence.lower()
+
+        if self.any_long_name is not None and self.any_long_name.search(lowercase_sentence):
+            for long_name, pattern, short_name in self.long_names:
+                if long_name in lowercase_sentence:
+                    lowercase_sentence = pattern.sub(short_name, lowercase_sentence)
+
+        for pattern, replacement in self.substitutions:
+            lowercase_sentence = pattern.sub(replacement, lowercase_sentence)
+
+        # the plain text names are only checked one by one if one of them is in the (current) sentence
+        any_author = self.any_literal_author is not None and self.any_literal_author.search(lowercase_sentence) is not None
+        for author, pattern, author_last_name, always in self.authors:
+            if always or (any_author and author in lowercase_sentence):
+                substituted = pattern.sub(author_last_name, lowercase_sentence)
+                if substituted != lowercase_sentence:
+                    lowercase_sentence = substituted
+                    any_author = self.any_literal_author is not None and self.any_literal_author.search(lowercase_sentence) is not None
+
+        return lowercase_sentence
+
+    def is_kept(self, word):
+        return word in self.keep_words or (self.keep_pattern is not None and self.keep_pattern.fullmatch(word) is not None)
+
+    # Only keep the keywords (and periods to mark where the sentences were). Returns the keyword sentence and the number of
+    # keywords in it
+    def remove_all_non_keywords(self, sentence):
+        if type(sentence) is list:
+            sentence = '.'.join(sentence)
+
+        sentence = self.substitute_keywords(sentence)
+        if self.policy.strip_characters:  # same as stripping each word, the characters are never spaces
+            sentence = sentence.translate(self.strip_table)
+
+        keep_words, keep_pattern = self.keep_words, self.keep_pattern
+        words = []
+        for word in sentence.split(" "):
+            if word in keep_words or (keep_pattern is not None and keep_pattern.fullmatch(word)):
+                words.append(word + " ")
+            elif word.endswith("."):
+                words.append(". ")
+
+        new_sentence = ''.join(words)
+        if '.' in new_sentence:
+            new_sentence = re.sub(r' \.', '.', new_sentence)  # spaces before the period
+            new_sentence = re.sub(r'\.+', '.', new_sentence)  # multiple periods
+
+        return new_sentence, len(new_sentence.split())
+
+
+_engines = {}
+
+
+# One engine per keywords dictionary and policy. The keywords dictionary shouldn't be changed after the engine is built
+def get_engine(keywords, policy=KEYWORD_SENTENCES_POLICY):
+    engine = _engines.get((id(keywords), id(policy)))
+    if engine is None or engine.keywords is not keywords:
+        engine = KeywordSubstitutionEngine(keywords, policy)
+        _engines[(id(keywords), id(policy))] = engine
+    return engine
+
+
+if __name__ == '__main__':
+    with open('../data/json/keywords.json') as f:
+        keywords = json.load(f)
+
+    s = 'In this study, cos temperature data from a satellite, Aura Microwave Limb Sounder (MLS) Version 3.3/3.4 Level 2 \
+[Waters et al., 2006], are also used to examine the dependence of the PMSE intensity on the background temperature cos'
+    for policy in [KEYWORD_SENTENCES_POLICY, AUTHOR_POLICY, VERSION_REQUIRED_POLICY]:
+        print(get_engine(keywords, policy).remove_all_non_keywords(s))
+
+    # time each policy on the sentences in the ml_data files
+    sentences = set()
+
+    def add_sentences(value):
+        if isinstance(value, str) and ' ' in value:
+            sentences.add(value)
+        elif isinstance(value, dict):
+            for item in value.values():
+                add_sentences(item)
+        elif isinstance(value, list):
+            for item in value:
+                add_sentences(item)
+
+    for location in glob.glob('ml_data/*.json'):
+        with open(location, encoding='utf-8') as f:
+            add_sentences(json.load(f))
+    sentences = sorted(sentences)
+    for name, policy in [('keyword_sentences', KEYWORD_SENTENCES_POLICY), ('author', AUTHOR_POLICY), ('version required', VERSION_REQUIRED_POLICY)]:
+        engine = get_engine(keywords, policy)
+        for function in [engine.substitute_keywords, engine.remove_all_non_keywords]:
+            start = time.perf_counter()
+            for sentence in sentences:
+                function(sentence)
+            print(f'{name} {function.__name__}: {(time.perf_counter() - start) / max(len(sentences), 1) * 1e6:.1f}us per sentence '
+                  f'({len(sentences)} sentences)')
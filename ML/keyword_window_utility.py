@@ -0,0 +1,210 @@
+import random
+import time
+import numpy as np
+
+'''
+    Find the keyword windows of a paper (used by keyword_sentences.py): runs of sentences dense enough in keywords to
+    possibly identify a dataset, from the number of keywords in each sentence of the paper.
+
+    A window starts at a sentence with keywords and takes the sentences after it until either
+        - there are more than max_sent_distance sentences in a row without keywords (that sentence is left out), or
+        - it has gone over max_num_sentences more sentences (the window then ends with that sentence)
+    and the next window starts at the next sentence with keywords after that. The window is kept if it has more than
+    total_required keywords, without the sentences with no keywords at its end. A window still open at the end of the
+    paper is dropped.
+
+    Rather than walking the counts one sentence at a time, every sentence with keywords is treated as a possible start:
+    where its window would end comes from the runs of sentences without keywords, and its number of keywords from the
+    prefix sums of the counts. Each possible start points to the start that follows it, and the windows that are
+    actually used are the ones reached from the first start of each paper. It all runs on NumPy arrays, for a whole batch
+    of papers at once, so a sweep over the parameters takes milliseconds
+'''
+
+
+# The counts of a batch of papers as one array, with the index of the last sentence of each sentence's paper and where each
+# paper starts in the array
+def concatenate_counts(paper_freqs):
+    lengths = np.array([len(freqs) for freqs in paper_freqs], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    freqs = np.concatenate([np.asarray(freqs, dtype=np.int64) for freqs in paper_freqs]) if len(paper_freqs) else np.zeros(0, np.int64)
+    paper_last = np.repeat(offsets[1:] - 1, lengths)
+    return freqs, paper_last, offsets
+
+
+class KeywordCounts:
+    # paper_freqs: for each paper, the number of keywords in each of its sentences
+    def __init__(self, paper_freqs):
+        self.freqs, self.paper_last, self.offsets = concatenate_counts(paper_freqs)
+        positions = np.arange(len(self.freqs))
+        self.starts = np.flatnonzero(self.freqs > 0)  # the sentences with keywords, where a window can start
+        self.cumulative = np.concatenate(([0], np.cumsum(self.freqs)))
+        # the last sentence with keywords at or before each sentence (-1 if there is none)
+        self.last_with_keywords = np.maximum.accumulate(np.where(self.freqs > 0, positions, -1)) if len(self.freqs) else positions
+        # how many sentences in a row without keywords end at each sentence
+        self.zero_run = np.where(self.freqs > 0, 0, positions - self.last_with_keywords)
+        # the index in starts of the first start at or after each sentence (len(starts) if there is none)
+        self.next_start = np.concatenate(([0], np.cumsum(self.freqs > 0)))
+        # the first start of each paper (that has one) is always used
+        first_starts, after_last_starts = self.next_start[self.offsets[:-1]], self.next_start[self.offsets[1:]]
+        self.paper_first_starts = first_starts[first_starts < after_last_starts]
+
+    # The windows of all the papers as three arrays: the paper (its index in the batch), and the start and end of the window
+    # in that paper. end is the last sentence of the window with keywords (the sentences are start to end inclusive)
+    def windows(self, max_sent_distance=3, max_num_sentences=3, total_required=4):
+        starts = self.starts
+        if len(starts) == 0:
+            return starts, starts, starts
+
+        # a window closes at the sentence that makes too many sentences without keywords in a row (left out of the window),
+        # or at the one that makes it too long (kept in the window), whichever comes first
+        zero_closes = np.flatnonzero(self.zero_run == max_sent_distance + 1)
+        zero_closes = np.append(zero_closes, np.iinfo(np.int64).max)
+        zero_close = zero_closes[np.searchsorted(zero_closes, starts, side='right')]
+        length_close = starts + max_num_sentences + 1
+        closed_by_zeros = zero_close <= length_close
+        close = np.where(closed_by_zeros, zero_close, length_close)
+        end = np.where(closed_by_zeros, close - 1, close)
+
+        # a window that doesn't close before the end of its paper is dropped, and the paper has no more windows
+        paper_last = self.paper_last[starts]
+        closed = close <= paper_last
+        end = np.minimum(end, paper_last)
+        keyword_count = self.cumulative[end + 1] - self.cumulative[starts]
+        kept = closed & (keyword_count > total_required)
+
+        # the start of the next window: the first sentence with keywords after the one that closed this window
+        following = self.next_start[np.where(closed, close + 1, paper_last + 1)]
+        used = self.reachable(following, self.paper_first_starts)
+
+        window = used & kept
+        papers = np.searchsorted(self.offsets, starts[window], side='right') - 1
+        return papers, starts[window] - self.offsets[papers], self.last_with_keywords[end[window]] - self.offsets[papers]
+
+    # Which starts are actually used: from the first start of each paper, follow each paper's windows to the start of its
+    # next window, all the papers in step. following[i] is the index of the start after start i (len(following) if there
+    # is none). A paper is done when it gets to a start that is already used (the first start of the next paper)
+    @staticmethod
+    def reachable(following, first_starts):
+        number_of_starts = len(following)
+        following = np.append(following, number_of_starts)  # past the last start stays there
+        used = np.zeros(number_of_starts + 1, dtype=bool)
+        used[first_starts] = True
+        used[number_of_starts] = True
+        current = first_starts
+        while len(current):
+            current = following[current]
+            current = current[~used[current]]
+            used[current] = True
+        return used[:-1]
+
+    # The windows of each paper, as (starts, ends)
+    def paper_windows(self, max_sent_distance=3, max_num_sentences=3, total_required=4):
+        papers, starts, ends = self.windows(max_sent_distance, max_num_sentences, total_required)
+        splits = np.searchsorted(papers, np.arange(1, len(self.offsets) - 1))
+        return list(zip(np.split(starts, splits), np.split(ends, splits)))[:len(self.offsets) - 1]
+
+
+# The (starts, ends) of the windows of one paper. freqs: the number of keywords in each sentence
+def find_keyword_windows(freqs, max_sent_distance=3, max_num_sentences=3, total_required=4):
+    return KeywordCounts([freqs]).paper_windows(max_sent_distance, max_num_sentences, total_required)[0]
+
+
+# The (starts, ends) of the windows of each paper in the batch. paper_freqs: the freqs of each paper
+def find_keyword_windows_batch(paper_freqs, max_sent_distance=3, max_num_sentences=3, total_required=4):
+    return KeywordCounts(paper_freqs).paper_windows(max_sent_distance, max_num_sentences, total_required)
+
+
+# The windows of the papers for every combination of the parameters: (max_sent_distance, max_num_sentences,
+# total_required) -> (papers, starts, ends) as in KeywordCounts.windows
+def sweep_keyword_windows(paper_freqs, max_sent_distances, max_nums_sentences, totals_required):
+    counts = KeywordCounts(paper_freqs)
+    return {(distance, num_sentences, total): counts.windows(distance, num_sentences, total)
+            for distance in max_sent_distances for num_sentences in max_nums_sentences for total in totals_required}
+
+
+def is_good_possibility(possibility, total_required):
+    return sum(possibility) > total_required
+
+
+def get_last_zero_index(possibilities):
+    # this is inefficient but should work ok
+    last_zero_index = len(possibilities)
+    for i in range(len(possibilities) - 1, -1, -1):
+        if possibilities[i] == 0:
+            last_zero_index = i
+        else:
+            break
+    return last_zero_index
+
+
+# the windows one sentence at a time, the way run_keyword_sentences used to find them. Returns the index lists of the windows
+def find_keyword_windows_reference(freqs, max_sent_distance=3, max_num_sentences=3, total_required=4):
+    in_potential_sequence = False
+    good_possibilities_index_list = []
+    possibilities = []
+    possibilities_index = []
+    cps_length = 0  # current possible sequence
+    cps_num_zeros = 0
+
+    for index, value in enumerate(freqs):
+        if value == 0 and not in_potential_sequence:
+            continue
+        if value > 0 and not in_potential_sequence:
+            in_potential_sequence = True
+            cps_num_zeros = 0  # every time we see a non-zero number, reset the zero count
+            possibilities.append(value)
+            possibilities_index.append(index)
+        elif value >= 0 and in_potential_sequence:  # can have zero values b/c now in sequence
+            if value == 0:
+                cps_num_zeros += 1
+                if cps_num_zeros > max_sent_distance:
+                    in_potential_sequence = False
+                    cps_num_zeros = 0
+                    cps_length = 0
+                    if is_good_possibility(possibilities, total_required):
+                        last_zero_index = get_last_zero_index(possibilities)
+                        good_possibilities_index_list.append(possibilities_index[:last_zero_index])
+                    possibilities = []
+                    possibilities_index = []
+                    continue
+            elif value > 0:
+                cps_num_zeros = 0
+            cps_length += 1
+            possibilities.append(value)
+            possibilities_index.append(index)
+            if cps_length > max_num_sentences:
+                in_potential_sequence = False
+                cps_num_zeros = 0
+                cps_length = 0
+                if is_good_possibility(possibilities, total_required):
+                    last_zero_index = get_last_zero_index(possibilities)
+                    good_possibilities_index_list.append(possibilities_index[:last_zero_index])
+                possibilities = []
+                possibilities_index = []
+
+    return good_possibilities_index_list
+
+
+# check the windows against the sentence at a time version on random papers, and time a parameter sweep
+if __name__ == '__main__':
+    random.seed(0)
+    papers = [[random.choice([0] * 12 + [1, 1, 2, 3, 5]) for _ in range(random.randint(0, 600))] for _ in range(2000)]
+    parameters = [(distance, num_sentences, total) for distance in range(0, 5) for num_sentences in range(0, 6) for total in range(0, 9)]
+
+    different = 0
+    for distance, num_sentences, total in random.sample(parameters, 20):
+        for freqs, (starts, ends) in zip(papers, find_keyword_windows_batch(papers, distance, num_sentences, total)):
+            reference = [(index_list[0], index_list[-1]) for index_list in find_keyword_windows_reference(freqs, distance, num_sentences, total)]
+            different += reference != list(zip(starts.tolist(), ends.tolist()))
+    print(f'{different} papers with different windows')
+
+    start = time.perf_counter()
+    sweep = sweep_keyword_windows(papers, range(0, 5), range(0, 6), range(0, 9))
+    elapsed = time.perf_counter() - start
+    print(f'sweep of {len(sweep)} parameter combinations over {len(papers)} papers: {elapsed * 1000:.1f}ms '
+          f'({elapsed / len(sweep) * 1000:.2f}ms per combination)')
+
+    start = time.perf_counter()
+    for freqs in papers:
+        find_keyword_windows_reference(freqs)
+    print(f'one sentence at a time, one combination: {(time.perf_counter() - start) * 1000:.1f}ms')
@@ -0,0 +1,35 @@
+'''
+    basic_clean for the keyword sentence builders (keyword_sentences.py and the attempts in
+    z_keyword_sentence_improvement_attempts), compiled once. The links are removed with remove_links from
+    CMR_queries/text_clean_utility.py instead of the backtracking regex (https?://)?([\da-z\.-]+)\.([a-z\.]{2,6})([/\w \.-]*),
+    which retries every position of every word and was most of the time spent cleaning a paper. The cleaned text is
+    exactly the same as running the regexes one after the other
+'''
+
+import re
+import sys
+from CMR_queries.text_clean_utility import remove_links, golden_differences
+
+# in order. Note the '.' in the abbreviations matches any character
+REWRITES = [(re.compile(r'[^\x00-\x7F]+'), ''),  # remove non unicode characters
+            (re.compile(r'et al.,?'), 'et al'),
+            (re.compile(r'e.g.,?'), 'eg'),
+            (re.compile(r'i.e.,?'), 'ie'),
+            (re.compile(r'\.[0-9]+'), ''),  # removing the decimals
+            (re.compile(r'\(\)'), '')]  # punctuation
+
+
+def basic_clean(text):
+    for pattern, replacement in REWRITES:
+        text = pattern.sub(replacement, text)
+    text = remove_links(text)
+    return text.replace('\n', ' ')  # after the links, since a link can go over a space but not a new line
+
+
+# check basic_clean against the golden excerpts (see CMR_queries/text_clean_utility.py). Fails if any of them is cleaned
+# differently
+if __name__ == '__main__':
+    changed = golden_differences(basic_clean, 'ml_clean')
+    print(f'{len(changed)} golden excerpts cleaned differently', changed)
+    if changed:
+        sys.exit(1)
@@ -1,5 +1,7 @@
 import json
 import re
+from ML.text_clean_utility import basic_clean
+from ML.keyword_substitution_utility import get_engine, VERSION_REQUIRED_POLICY
 
 '''
     Represent papers as series of only keywords. Sentences represent sections that potentially identify a dataset. 
@@ -20,73 +22,12 @@ def get_text(paper, alt_path=''):
     return text
 
 
-def basic_clean(text):
-    text = re.sub(r'[^\x00-\x7F]+', '', text)  # remove non unicode characters
-    text = re.sub(r'et al.,?', 'et al', text)
-    text = re.sub(r'e.g.,?', 'eg', text)
-    text = re.sub(r'i.e.,?', 'ie', text)
-    text = re.sub(r'\.[0-9]+', '', text)  # removing the decimals
-    text = re.sub(r'\(\)', '', text)  # punctuation
-    text = re.sub(r'(https?://)?([\da-z\.-]+)\.([a-z\.]{2,6})([/\w \.-]*)', '', text)  # removing the links
-
-    text = re.sub('\n', ' ', text)
-    return text
-
-
 def remove_all_non_keywords(sentence, keywords):
-    if type(sentence) is list:
-        sentence = '.'.join(sentence)
-
-    missions_short = list(keywords['missions']['short_to_long'])
-    instruments_short = list(keywords['instruments']['short_to_long'])
-    variables_short = list(keywords['variables']['short_to_long'])
-
-    sentence = substitute_keywords(sentence, keywords)
-
-    new_sentence = ""
-    for word in sentence.split(" "):
-        if word != 'no' and (
-                word in missions_short or word in instruments_short or word in variables_short or re.fullmatch(r'v\d',
-                                                                                                               word)):
-            new_sentence += word + " "
-        elif word.endswith("."):
-            new_sentence += ". "
-
-    new_sentence = re.sub(r' \.', '.', new_sentence)  # spaces before the period
-    new_sentence = re.sub(r'\.+', '.', new_sentence)  # multiple periods
-
-    return new_sentence, len(new_sentence.split())
+    return get_engine(keywords, VERSION_REQUIRED_POLICY).remove_all_non_keywords(sentence)
 
 
 def substitute_keywords(sentence, keywords):
-    lowercase_sentence = sentence.lower()
-
-    missions = list(keywords['missions']['long_to_short'])
-    instruments = list(keywords['instruments']['long_to_short'])
-    variables = list(keywords['variables']['long_to_short'])
-
-    for long_m in missions:
-        if long_m in lowercase_sentence and long_m != '':
-            short_m = keywords['missions']['long_to_short'][long_m]
-            lowercase_sentence = re.sub(rf'{long_m}', f'{short_m}', lowercase_sentence)
-
-    for long_i in instruments:
-        if long_i in lowercase_sentence and long_i != '':
-            short_i = keywords['instruments']['long_to_short'][long_i]
-            lowercase_sentence = re.sub(rf'{long_i}', f'{short_i}', lowercase_sentence)
-
-    for long_v in variables:
-        if long_v in lowercase_sentence and long_v != '':
-            short_v = keywords['variables']['long_to_short'][long_v]
-            lowercase_sentence = re.sub(rf'{long_v}', f'{short_v}', lowercase_sentence)
-
-    # see if dataset versions are mentioned and replace 'version 4' with v4
-    lowercase_sentence = re.sub(r'[vV]ersion ([0-9])', 'v\\1', lowercase_sentence)
-
-    # see if levels are mentioned
-    lowercase_sentence = re.sub(r'[lL]evel ([0-9])', 'L\\1', lowercase_sentence)
-
-    return lowercase_sentence
+    return get_engine(keywords, VERSION_REQUIRED_POLICY).substitute_keywords(sentence)
 
 
 def is_good_possibility(possibility, total_required):